@@ -0,0 +1,328 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import math
+import random
+import argparse
+import platform
+import subprocess
+import importlib.util
+
+
+SIMULATOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mdvrd-simulator.py")
+
+
+def load_simulator():
+    # the simulator is a script with a dash in the name, thus it can not
+    # be imported the regular way. Its worker processes can not import
+    # the module loaded here, whole runs use run_simulator() instead.
+    spec = importlib.util.spec_from_file_location("mdvrd_simulator", SIMULATOR)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def random_topology(no_router, degree, seed):
+    """random geometric graph with roughly degree neighbors per router,
+    edges carry a loss and a bandwidth weight like the interfaces in ti"""
+    rnd = random.Random(seed)
+    interfaces = ((20, 10000), (5, 1000), (30, 30000), (10, 2000))
+    pos = [(rnd.random(), rnd.random()) for _ in range(no_router)]
+    radius = (degree / (no_router * 3.14159)) ** 0.5
+    edges = list()
+    for i in range(no_router):
+        for j in range(i + 1, no_router):
+            dx = pos[i][0] - pos[j][0]
+            dy = pos[i][1] - pos[j][1]
+            if dx * dx + dy * dy <= radius * radius:
+                loss, bandwidth = rnd.choice(interfaces)
+                edges.append((i, j, loss, bandwidth))
+    return edges
+
+
+def paths_networkx(edges, source, dests):
+    """the former implementation: one graph for both metrics and one
+    shortest path search per destination and metric, bandwidth is
+    used as additive weight"""
+    import networkx as nx
+    result = dict()
+    G = nx.Graph()
+    for metric, idx in (('low_loss', 2), ('high_bandwidth', 3)):
+        for edge in edges:
+            G.add_edge(edge[0], edge[1], weight=edge[idx])
+        for dest in dests:
+            try:
+                result[(metric, dest)] = nx.shortest_path(G, dest, source, weight='weight')
+            except (nx.exception.NetworkXNoPath, nx.exception.NodeNotFound):
+                continue
+    return result
+
+
+def paths_engine(sim, edges, source, dests):
+    result = dict()
+    engine = sim.PathEngine()
+    for metric, idx in (('low_loss', 2), ('high_bandwidth', 3)):
+        for edge in edges:
+            engine.add_edge(metric, edge[0], edge[1], edge[idx])
+        if metric == 'high_bandwidth':
+            trees = engine.widest_paths(metric, source)
+        else:
+            pred = engine.shortest_paths(metric, source)
+            trees = dict.fromkeys(pred, pred)
+        for dest in dests:
+            if dest in trees:
+                result[(metric, dest)] = sim.PathEngine.path_to_source(trees[dest], dest)
+    return result
+
+
+def path_cost(weights, path):
+    return sum(weights[(a, b)] for a, b in zip(path, path[1:]))
+
+
+def measure(func, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def bench_path_engine(args):
+    sim = load_simulator()
+    # import before measuring
+    import networkx
+    print("{:>8} {:>8} {:>14} {:>14} {:>8}".format("routers", "edges", "networkx [ms]", "engine [ms]", "speedup"))
+    for no_router in args.routers:
+        edges = random_topology(no_router, args.degree, args.seed)
+        source = 0
+        dests = list(range(1, no_router))
+        t_nx, r_nx = measure(paths_networkx, edges, source, dests, repeat=args.repeat)
+        t_engine, r_engine = measure(paths_engine, sim, edges, source, dests, repeat=args.repeat)
+        # the former implementation mixes both metrics in one graph, thus
+        # only the low loss results are comparable
+        loss = dict()
+        for edge in edges:
+            loss[(edge[0], edge[1])] = loss[(edge[1], edge[0])] = edge[2]
+        for key, path in r_engine.items():
+            if key[0] != 'low_loss' or key not in r_nx:
+                continue
+            if path_cost(loss, path) != path_cost(loss, r_nx[key]):
+                print("warning: different path cost for {}".format(key))
+        print("{:8} {:8} {:14.2f} {:14.2f} {:7.1f}x".format(no_router, len(edges),
+              t_nx * 1000, t_engine * 1000, t_nx / t_engine))
+
+
+def scaling_area(no_router, density):
+    """dense is the default area of the simulator where every router
+    reaches every other, sparse is sized for roughly 8 neighbors via the
+    longest range interface"""
+    if density == "dense":
+        return 10, 10
+    side = int(math.sqrt(no_router * math.pi * 300 ** 2 / 8))
+    return side, side
+
+
+def run_simulator(argv, output_dir, timeout):
+    """One simulation run as a separate process, thus the peak RSS is the
+    one of this run only and the worker processes of the simulator can
+    import it. Returns the summary of the run, or a dict with the status
+    only if it timed out or failed."""
+    os.makedirs(output_dir, exist_ok=True)
+    summary_path = os.path.join(output_dir, "summary.json")
+    argv = [sys.executable, SIMULATOR] + argv + ["--output-dir", output_dir, "--summary-json", summary_path]
+    try:
+        process = subprocess.run(argv, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                 text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {"status": "timeout"}
+    if process.returncode != 0:
+        lines = process.stderr.strip().splitlines()
+        return {"status": "failed ({}): {}".format(process.returncode, lines[-1] if lines else "")}
+    with open(summary_path) as fd:
+        summary = json.load(fd)
+    summary["status"] = "ok"
+    return summary
+
+
+def scaling_matrix(args):
+    for no_router in args.routers:
+        for density in args.density:
+            for sim_time in args.time:
+                yield {"routers": no_router, "density": density, "time": sim_time}
+
+
+def run_scaling(config, args, output_dir):
+    """best of args.repeat runs, the one with the lowest wall time"""
+    x, y = scaling_area(config["routers"], config["density"])
+    argv = ["--routers", str(config["routers"]), "--area", str(x), str(y),
+            "--time", str(config["time"]), "--seed", str(args.seed), "--log-level", "off",
+            "--instrument", "--instrument-interval", "0"] + args.sim_args.split()
+    summary = None
+    for _ in range(args.repeat):
+        run = run_simulator(argv, output_dir, args.timeout)
+        if run["status"] != "ok":
+            return run
+        if summary is None or run["wall-time"] < summary["wall-time"]:
+            summary = run
+    # inclusive phase times of the simulator instrumentation
+    phases = {key[len("phase-"):]: round(value, 4) for key, value in summary.items() if key.startswith("phase-")}
+    return {"status": "ok", "wall-time": summary["wall-time"], "route-recalc": summary["route-recalc"],
+            "peak-rss": summary["peak-rss"], "phases": phases,
+            "wall-per-sim-sec": summary["wall-time"] / config["time"]}
+
+
+def scaling_key(result):
+    return (result["routers"], result["density"], result["time"])
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    return out.stdout.strip() or None
+
+
+def compare_scaling(results, baseline_path, threshold, min_time):
+    """returns the number of runs slower than the baseline by more than
+    threshold (relative). Runs shorter than min_time seconds are too
+    noisy to be compared, they are never counted."""
+    with open(baseline_path) as fd:
+        baseline = {scaling_key(r): r for r in json.load(fd)["results"] if r["status"] == "ok"}
+    regressions = 0
+    print("\ncompared with {} (threshold {:.0%}, runs below {}s ignored):".format(
+          baseline_path, threshold, min_time))
+    for result in results:
+        base = baseline.get(scaling_key(result))
+        if base is None or result["status"] != "ok":
+            continue
+        change = result["wall-per-sim-sec"] / base["wall-per-sim-sec"] - 1
+        flag = ""
+        if result["wall-time"] < min_time:
+            flag = "too short"
+        elif change > threshold:
+            flag = "REGRESSION"
+            regressions += 1
+        print("{:8} {:>7} {:6} {:+8.1%} {}".format(*scaling_key(result), change, flag))
+    return regressions
+
+
+def bench_scaling(args):
+    output_dir = os.path.abspath(args.output_dir)
+    results = list()
+    print("{:>8} {:>7} {:>6} {:>10} {:>14} {:>8} {:>10}  {}".format(
+          "routers", "density", "time", "wall [s]", "wall/sim-sec", "recalcs", "rss [MB]", "phases [s]"))
+    for config in scaling_matrix(args):
+        result = dict(config)
+        result.update(run_scaling(config, args, output_dir))
+        results.append(result)
+        if result["status"] != "ok":
+            print("{:8} {:>7} {:6} {}".format(*scaling_key(result), result["status"]))
+            continue
+        rss = result["peak-rss"] / 1024 if result["peak-rss"] else float("nan")
+        phases = " ".join("{}:{:.2f}".format(phase, t) for phase, t in result["phases"].items())
+        print("{:8} {:>7} {:6} {:10.2f} {:14.4f} {:8} {:10.1f}  {}".format(
+              *scaling_key(result), result["wall-time"], result["wall-per-sim-sec"],
+              result["route-recalc"], rss, phases))
+    report = {"commit": git_commit(), "python": platform.python_version(),
+              "sim-args": args.sim_args, "seed": args.seed, "repeat": args.repeat, "results": results}
+    with open(args.json, "w") as fd:
+        json.dump(report, fd, indent=2)
+    print("results written to {}".format(args.json))
+    if args.compare and compare_scaling(results, args.compare, args.threshold, args.min_time) > 0:
+        sys.exit(1)
+
+
+def bench_event_driven(args):
+    """runs every scenario with the polling loop and with --event-driven,
+    the summaries and flow statistics must be identical"""
+    # measurements of the run, not results of the simulation
+    ignored = ("wall-time", "peak-rss")
+    output_dir = os.path.abspath(args.output_dir)
+    mismatches = 0
+    print("{:>8} {:>7} {:>6} {:>12} {:>12} {:>8}  {}".format(
+          "routers", "density", "time", "polling [s]", "events [s]", "speedup", "result"))
+    for config in scaling_matrix(args):
+        x, y = scaling_area(config["routers"], config["density"])
+        argv = ["--routers", str(config["routers"]), "--area", str(x), str(y),
+                "--time", str(config["time"]), "--seed", str(args.seed),
+                "--log-level", "off"] + args.sim_args.split()
+        polling = run_simulator(argv, output_dir, args.timeout)
+        events = run_simulator(argv + ["--event-driven"], output_dir, args.timeout)
+        if polling["status"] != "ok" or events["status"] != "ok":
+            print("{:8} {:>7} {:6} {} / {}".format(*scaling_key(config), polling["status"], events["status"]))
+            mismatches += 1
+            continue
+        differences = sorted(key for key in polling.keys() | events.keys()
+                             if key not in ignored and polling.get(key) != events.get(key))
+        if differences:
+            mismatches += 1
+        print("{:8} {:>7} {:6} {:12.2f} {:12.2f} {:7.2f}x  {}".format(
+              *scaling_key(config), polling["wall-time"], events["wall-time"],
+              polling["wall-time"] / events["wall-time"],
+              "differs: " + ", ".join(differences) if differences else "identical"))
+    if mismatches > 0:
+        sys.exit(1)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="MDVRD simulator benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark")
+    subparsers.required = True
+
+    # networkx is no runtime dependency of the simulator, it is required
+    # by this comparison only: pip install networkx
+    p = subparsers.add_parser("path-engine", help="compare the path engine with per destination networkx "
+                                                  "searches, requires networkx")
+    p.add_argument("--routers", type=int, nargs="+", default=[50, 500, 2000])
+    p.add_argument("--degree", type=int, default=8, help="average number of neighbors per router")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--seed", type=int, default=1)
+    p.set_defaults(func=bench_path_engine)
+
+    p = subparsers.add_parser("scaling", help="headless simulation runs over a matrix of router counts, "
+                                              "densities and durations")
+    p.add_argument("--routers", type=int, nargs="+", default=[50, 200, 1000, 5000])
+    p.add_argument("--density", nargs="+", choices=("dense", "sparse"), default=["dense", "sparse"])
+    p.add_argument("--time", type=int, nargs="+", default=[60], help="simulated seconds")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--sim-args", default="", help="further simulator options, e.g. \"--coalesce-recalc\"")
+    p.add_argument("--timeout", type=float, default=600, help="wall time limit per run in seconds")
+    p.add_argument("--output-dir", default="bench-output", help="directory for the simulator output")
+    p.add_argument("--json", default="bench-scaling.json", help="result file")
+    p.add_argument("--compare", metavar="JSON", help="result file of a baseline run")
+    p.add_argument("--threshold", type=float, default=0.1,
+                   help="relative slowdown of the wall time per simulated second reported as regression")
+    p.add_argument("--min-time", type=float, default=1.0, metavar="SEC",
+                   help="runs with less wall time are never reported as regression")
+    p.add_argument("--repeat", type=int, default=3, help="runs per configuration, the fastest one counts")
+    p.set_defaults(func=bench_scaling)
+
+    p = subparsers.add_parser("event-driven", help="compare the event scheduler with the polling loop, "
+                                                   "the results must be identical")
+    p.add_argument("--routers", type=int, nargs="+", default=[40, 300])
+    p.add_argument("--density", nargs="+", choices=("dense", "sparse"), default=["sparse"])
+    p.add_argument("--time", type=int, nargs="+", default=[300], help="simulated seconds")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--sim-args", default="", help="further simulator options for both loops")
+    p.add_argument("--timeout", type=float, default=600, help="wall time limit per run in seconds")
+    p.add_argument("--output-dir", default="bench-output", help="directory for the simulator output")
+    p.set_defaults(func=bench_event_driven)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
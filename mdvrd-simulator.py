@@ -14,11 +14,20 @@ import functools
 import uuid
 import random
 import math
-import addict
 import cairo
 import shutil
-import copy
-from PIL import Image
+import heapq
+import collections
+import array
+import zlib
+import itertools
+import csv
+import contextlib
+import concurrent.futures
+import subprocess
+import multiprocessing
+import pickle
+import io
 
 
 
@@ -36,23 +45,587 @@ SIMU_AREA_Y = 10 # 1080
 
 DEFAULT_PACKET_TTL = 16
 
-random.seed(1)
+# interface table of every router
+INTERFACES = [ {"path_type": "2", "range" : 50, "bandwidth" : 10000, "loss" : 20},
+               {"path_type": "1", "range" : 200, "bandwidth" : 1000, "loss" : 5 },
+               {"path_type": "4", "range" : 100, "bandwidth" : 30000, "loss" : 30},
+               {"path_type": "3", "range" : 300, "bandwidth" : 2000, "loss" : 10 }  ]
+
+SEED = 1
+
+# when enabled, received packets and expiries only mark the routing
+# table as stale, it is recalculated once at the end of the tick, before
+# the router transmits or after the hold-down time
+ROUTE_RECALC_COALESCE = False
+ROUTE_RECALC_HOLDDOWN = 0
 
 # statitics variables follows
-NEIGHBOR_INFO_ACTIVE = 0
+ROUTE_RECALC_REQUESTS = 0
+ROUTE_RECALC = 0
+# time of the last FIB change of any router
+FIB_LAST_CHANGE = 0
+DATA_DELIVERED = 0
+DATA_DROPPED = 0
+DATA_LOOPS = 0
 
 PATH_LOGS = "logs"
-PATH_IMAGES_RANGE = "images-range"
-PATH_IMAGES_TX    = "images-tx"
+LOG_FILE = "routers.log"
+
+LOG_DEBUG = 10
+LOG_INFO = 20
+LOG_OFF = 100
+LOG_LEVELS = {"debug": LOG_DEBUG, "info": LOG_INFO, "off": LOG_OFF}
+LOG_LEVEL = LOG_DEBUG
+# shared LogSink of all routers, set up in main()
+LOG_SINK = None
+
+# opt-in binary event trace (TraceWriter), see mdvrd-trace.py
+TRACE = None
+
+# Instrumentation of --instrument
+INSTR = None
+
+# TrafficEngine of the last simulation, for the per flow statistics
+TRAFFIC = None
+
+# Medium of --medium, route packets are received within the transmit
+# loop if None
+MEDIUM = None
+
+# EventScheduler of --event-driven, the routers read their time from it.
+# Every router keeps its own time in the polling loop if None
+CLOCK = None
+TRACE_ROUTE_TX = 1
+TRACE_ROUTE_RX = 2
+TRACE_EXPIRE = 3
+TRACE_RECALC = 4
+TRACE_ROUTE_CHANGE = {'low_loss': 5, 'high_bandwidth': 6}
+TRACE_DATA_FWD = 7
+TRACE_DATA_DELIVER = 8
+TRACE_DATA_DROP = 9
+CHECKPOINT_MAGIC = b"MDVRDCK1"
 PATH_IMAGES_MERGE = "images-merge"
+# both panels are composed side by side into one video frame
+FRAME_WIDTH = 1920
+FRAME_HEIGHT = 1080
+
+
+
+
+class LazyPFormat:
+    """pretty prints obj when formatted, thus not at all if the log
+    level is disabled"""
+
+    __slots__ = ('obj',)
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __str__(self):
+        return pprint.pformat(self.obj)
+
+    def __format__(self, format_spec):
+        return format(str(self), format_spec)
+
+
+class LogSink:
+    """One buffered log file shared by all routers, instead of one file
+    descriptor per router. Every line is prefixed with the router id, a
+    multi line message results in multiple prefixed lines. shard() splits
+    the file into per router files afterwards."""
+
+    def __init__(self, path, buffer_size=1 << 20):
+        self.path = path
+        self._fd = open(path, 'w', buffering=buffer_size)
+
+
+    def write(self, router_id, time, msg, args):
+        if args:
+            msg = msg.format(*args)
+        msg = "{:5}: {}".format(time, msg)
+        prefix = "{} ".format(router_id)
+        self._fd.write(prefix + msg.replace("\n", "\n" + prefix) + "\n")
+
+
+    def close(self):
+        self._fd.close()
+
+
+    def shard(self, path, buffer_lines=10000):
+        """writes the lines of every router into <path>/<router id>.log,
+        the per router buffers are appended when full, thus at most one
+        file is open at any time"""
+        buffers = dict()
+
+        def flush(router_id):
+            file_path = os.path.join(path, "{0:05}.log".format(int(router_id)))
+            with open(file_path, 'a') as fd:
+                fd.writelines(buffers.pop(router_id))
+
+        with open(self.path) as fd:
+            for line in fd:
+                router_id, line = line.split(" ", 1)
+                lines = buffers.setdefault(router_id, list())
+                lines.append(line)
+                if len(lines) >= buffer_lines:
+                    flush(router_id)
+        for router_id in list(buffers):
+            flush(router_id)
+
+
+class TraceWriter:
+    """Binary event trace with fixed size records. Records are buffered
+    column-wise and written in chunks, every column zlib compressed, thus
+    a reader decompresses only the columns it needs. Layout, little
+    endian:
+
+        magic "MDVRDTR1"
+        per chunk: uint32 record count,
+                   per column: uint32 length, compressed column array
+
+    Router ids are stored as integers, interfaces as their index in the
+    interface table, thus any path_type fits the byte column. -1 is
+    "none"."""
+
+    MAGIC = b"MDVRDTR1"
+    # name and array typecode of every column, in file order
+    COLUMNS = (("time", "d"), ("router", "i"), ("event", "B"), ("peer", "i"),
+               ("interface", "b"), ("seq-no", "i"), ("fib-version", "i"))
+
+    def __init__(self, path, chunk_records=65536):
+        self.chunk_records = chunk_records
+        self._fd = open(path, 'wb')
+        self._fd.write(TraceWriter.MAGIC)
+        self._new_chunk()
+
+
+    def _new_chunk(self):
+        self._columns = [array.array(typecode) for _, typecode in TraceWriter.COLUMNS]
 
 
+    def record(self, time, router, event, peer=-1, interface=-1, seq_no=-1, fib_version=-1):
+        c = self._columns
+        c[0].append(time)
+        c[1].append(int(router))
+        c[2].append(event)
+        c[3].append(int(peer))
+        c[4].append(int(interface))
+        c[5].append(int(seq_no))
+        c[6].append(fib_version)
+        if len(c[0]) >= self.chunk_records:
+            self.flush()
+
+
+    def flush(self):
+        if len(self._columns[0]) == 0:
+            return
+        self._fd.write(struct.pack("<I", len(self._columns[0])))
+        for column in self._columns:
+            if sys.byteorder != "little":
+                column.byteswap()
+            data = zlib.compress(column.tobytes())
+            self._fd.write(struct.pack("<I", len(data)))
+            self._fd.write(data)
+        self._new_chunk()
+
+
+    def close(self):
+        self.flush()
+        self._fd.close()
+
+
+class Instrumentation:
+    """Per phase wall time histograms and hot path counters of
+    --instrument. Phases are timed by wrapping the functions of PHASES
+    while installed, thus disabled instrumentation costs nothing. Phases
+    are inclusive: route-tx contains the receive processing of the
+    neighbors and, without --coalesce-recalc, their recalculations."""
+
+    # (phase, class or None for module functions, function)
+    PHASES = (("mobility", "Router", "move"),
+              ("mobility", "VectorizedMobility", "move"),
+              ("distance", "SpatialIndex", "update"),
+              ("distance", "VectorizedMobility", "dist_update"),
+              ("route-tx", "Router", "tx_route_packet"),
+              ("route-rx", "Router", "_rx_save_routing_data"),
+              ("expire", "Router", "expire_route_entries"),
+              ("recalc", "Router", "_recalculate_routing_table"),
+              ("recalc", "ParallelRecalc", "run"),
+              ("dijkstra", "PathEngine", "shortest_paths"),
+              ("dijkstra", "PathEngine", "widest_paths"),
+              ("lookup", "Router", "_lookup"),
+              ("medium", "Medium", "deliver"),
+              ("traffic", "TrafficEngine", "send"))
+
+    def __init__(self):
+        # phase -> [calls, total, max, histogram of log2 microseconds]
+        self.phases = dict()
+        self.counters = collections.Counter()
+        self._originals = list()
+
+
+    def _timed(self, phase, func):
+        stats = self.phases.setdefault(phase, [0, 0.0, 0.0, collections.Counter()])
+        perf_counter = time.perf_counter
+
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - start
+                stats[0] += 1
+                stats[1] += elapsed
+                if elapsed > stats[2]:
+                    stats[2] = elapsed
+                stats[3][int(elapsed * 1e6).bit_length()] += 1
+        return functools.update_wrapper(timed, func)
+
+
+    def install(self):
+        module = globals()
+        for phase, owner, name in self.PHASES:
+            if owner is None:
+                func = module[name]
+                module[name] = self._timed(phase, func)
+            else:
+                func = module[owner].__dict__[name]
+                setattr(module[owner], name, self._timed(phase, func))
+            self._originals.append((owner, name, func))
+
+
+    def uninstall(self):
+        module = globals()
+        for owner, name, func in reversed(self._originals):
+            if owner is None:
+                module[name] = func
+            else:
+                setattr(module[owner], name, func)
+        self._originals = list()
+
+
+    @staticmethod
+    def _percentile(histogram, calls, fraction):
+        # upper bound of the bucket, in microseconds
+        seen = 0
+        for bucket in sorted(histogram):
+            seen += histogram[bucket]
+            if seen >= calls * fraction:
+                return 2 ** bucket
+        return 0
+
+
+    def report(self, r):
+        phases = dict()
+        for phase, (calls, total, max_, histogram) in sorted(self.phases.items()):
+            if calls == 0:
+                continue
+            phases[phase] = {"calls": calls, "total": round(total, 6), "max": round(max_, 6),
+                             "histogram-us": {"<{}".format(2 ** b): n for b, n in sorted(histogram.items())}}
+        fib_entries = [sum(len(index) for index in router.fib_index.values()) for router in r.values()]
+        gauges = {"neighbor-info-active": sum(len(neighs) for router in r.values()
+                                              for neighs in router.route_rx_data.values()),
+                  "fib-entries-total": sum(fib_entries),
+                  "fib-entries-max": max(fib_entries, default=0),
+                  "route-recalc-requested": ROUTE_RECALC_REQUESTS,
+                  "route-recalc": ROUTE_RECALC,
+                  "route-recalc-skipped": ROUTE_RECALC_REQUESTS - ROUTE_RECALC}
+        return {"phases": phases, "counters": dict(sorted(self.counters.items())), "gauges": gauges}
+
+
+    def print_table(self, sec, r):
+        report = self.report(r)
+        print("\ninstrumentation after {} s".format(sec))
+        print("{:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+              "phase", "calls", "total [s]", "mean [us]", "p50 [us]", "p99 [us]", "max [us]"))
+        for phase, (calls, total, max_, histogram) in sorted(self.phases.items()):
+            if calls == 0:
+                continue
+            print("{:>10} {:10} {:10.3f} {:10.1f} {:>10} {:>10} {:10.0f}".format(
+                  phase, calls, total, total / calls * 1e6, "<" + str(self._percentile(histogram, calls, 0.5)),
+                  "<" + str(self._percentile(histogram, calls, 0.99)), max_ * 1e6))
+        for name, value in list(report["counters"].items()) + list(report["gauges"].items()):
+            print("{:>24}: {}".format(name, value))
+
+
+class LogBuffer:
+    """LogSink replacement in ParallelRecalc workers, keeps the formatted
+    messages to be written by the main process"""
+
+    def __init__(self):
+        self.lines = list()
+
+
+    def write(self, router_id, time, msg, args):
+        if args:
+            msg = msg.format(*args)
+        self.lines.append((time, "{}".format(msg)))
+
+
+def _recalc_worker(log_level, batch):
+    global LOG_LEVEL, LOG_SINK, TRACE
+    LOG_LEVEL = log_level
+    TRACE = None
+    results = list()
+    for router_id, time, ti, route_rx_data in batch:
+        LOG_SINK = LogBuffer()
+        router = Router.recalc_shell(router_id, time, ti, route_rx_data)
+        results.append((router._compute_fib(), LOG_SINK.lines))
+    LOG_SINK = None
+    return results
+
+
+class ParallelRecalc:
+    """Recalculates the stale routing tables at the end of a tick in a
+    process pool. A FIB depends on the received routing data and the
+    interface table of the router only; these are sent to the workers in
+    batches, shared packets of a batch are serialized once. The FIBs and
+    log messages are taken over in router order, thus the result is the
+    same as of the serial recalculation."""
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+        # forked workers would inherit the buffers of the open log and
+        # trace files and flush them a second time
+        context = multiprocessing.get_context("spawn")
+        self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=jobs, mp_context=context)
+
+
+    def run(self, routers):
+        stale = [router for router in routers if router.recalc_due()]
+        if len(stale) == 0:
+            return
+        size = -(-len(stale) // self.jobs)
+        batches = list()
+        for i in range(0, len(stale), size):
+            batches.append([(router.id, router.time, router.ti, router.route_rx_data)
+                            for router in stale[i:i + size]])
+        results = self.pool.map(_recalc_worker, [LOG_LEVEL] * len(batches), batches)
+        results = itertools.chain.from_iterable(results)
+        for router, (fib, log_lines) in zip(stale, results):
+            router.install_fib(fib, log_lines)
+
+
+    def close(self):
+        self.pool.shutdown()
+
+
+class FrozenDict(dict):
+    """Read-only dict, used for FIB snapshots which are advertised to and
+    stored by other routers without copying"""
+
+    __slots__ = ()
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("FrozenDict is read-only")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+
+def freeze(obj, last=None):
+    """Recursively converts dicts and lists into FrozenDicts and tuples.
+    Parts equal to the corresponding part of the last snapshot are taken
+    from it, thus consecutive snapshots share all unchanged parts and
+    last itself is returned if nothing changed."""
+    if isinstance(obj, FrozenDict):
+        # snapshot parts of other routers, possibly an equal copy of them
+        if obj is not last and type(last) is FrozenDict and obj == last:
+            return last
+        return obj
+    if isinstance(obj, dict):
+        last_items = last if isinstance(last, FrozenDict) else dict()
+        frozen = FrozenDict((k, freeze(v, last_items.get(k))) for k, v in obj.items())
+    elif isinstance(obj, list):
+        frozen = tuple(freeze(v) for v in obj)
+    else:
+        return obj
+    if type(last) is type(frozen) and frozen == last:
+        return last
+    return frozen
+
+
+def thaw(mapping, key):
+    """returns mapping[key] writable, a FrozenDict is replaced by a copy
+    of it on the first write (copy on write)"""
+    value = mapping[key]
+    if isinstance(value, FrozenDict):
+        value = mapping[key] = dict(value)
+    return value
+
+
+class PathEngine:
+    """Undirected weighted graph per metric. One single source search per
+    metric yields the predecessor tree from which all FIB entries of this
+    metric are filled, instead of one search per destination."""
+
+    def __init__(self):
+        self.graphs = dict()
+
+
+    def add_edge(self, metric, a, b, weight):
+        # adding an existing edge again updates the weight
+        adj = self.graphs.setdefault(metric, dict())
+        adj.setdefault(a, dict())[b] = weight
+        adj.setdefault(b, dict())[a] = weight
+
+
+    def shortest_paths(self, metric, source):
+        """Dijkstra, returns the predecessor of every reachable node,
+        the source has None as predecessor"""
+        adj = self.graphs.get(metric, dict())
+        dist = {source: 0}
+        pred = {source: None}
+        done = set()
+        # sequence number as tie breaker, nodes are never compared
+        seq = 0
+        heap = [(0, seq, source)]
+        while heap:
+            d, _, node = heapq.heappop(heap)
+            if node in done:
+                continue
+            done.add(node)
+            for other, weight in adj.get(node, {}).items():
+                d_other = d + weight
+                if other not in dist or d_other < dist[other]:
+                    dist[other] = d_other
+                    pred[other] = node
+                    seq += 1
+                    heapq.heappush(heap, (d_other, seq, other))
+        return pred
+
+
+    def widest_paths(self, metric, source):
+        """Widest (maximum bottleneck) paths, equal bottlenecks are ordered
+        by hop count. Dijkstra with a max-heap yields the bottleneck of
+        every node, then one breadth first search per distinct bottleneck
+        over the edges at least that wide yields the fewest hops. These
+        paths do not form one predecessor tree, thus a tree per node is
+        returned, nodes with the same bottleneck share it:
+        path_to_source(trees[dest], dest)"""
+        adj = self.graphs.get(metric, dict())
+        width = {source: math.inf}
+        done = set()
+        seq = 0
+        heap = [(-math.inf, seq, source)]
+        while heap:
+            neg_width, _, node = heapq.heappop(heap)
+            if node in done:
+                continue
+            done.add(node)
+            for other, weight in adj.get(node, {}).items():
+                if other in done:
+                    continue
+                w_other = min(-neg_width, weight)
+                if other not in width or w_other > width[other]:
+                    width[other] = w_other
+                    seq += 1
+                    heapq.heappush(heap, (-w_other, seq, other))
+        trees = dict()
+        by_width = dict()
+        for node, bottleneck in width.items():
+            if bottleneck not in by_width:
+                by_width[bottleneck] = self._fewest_hops(adj, source, bottleneck)
+            trees[node] = by_width[bottleneck]
+        return trees
+
+
+    @staticmethod
+    def _fewest_hops(adj, source, min_weight):
+        """breadth first search over the edges of at least min_weight,
+        returns the predecessor of every reachable node"""
+        pred = {source: None}
+        queue = collections.deque([source])
+        while queue:
+            node = queue.popleft()
+            for other, weight in adj.get(node, {}).items():
+                if weight >= min_weight and other not in pred:
+                    pred[other] = node
+                    queue.append(other)
+        return pred
+
+
+    @staticmethod
+    def path_to_source(pred, dest):
+        """path from dest back to the search source, thus dest is the
+        first and the source the last element, None if unreachable"""
+        if dest not in pred:
+            return None
+        path = [dest]
+        while pred[path[-1]] is not None:
+            path.append(pred[path[-1]])
+        return path
+
+
+class Terminal:
+    """Neighbors of a router on one interface. Router ids are kept in
+    the order they came into range, a bitset of them answers membership
+    tests. routers maps an id to its Router, it is shared by all
+    terminals."""
+
+    __slots__ = ('order', 'bits', 'sequence_no', 'routers')
+
+    def __init__(self, routers):
+        self.order = array.array('i')
+        self.bits = 0
+        # we initialize and handle as many sequence numbers
+        # as interfaces because sequence numbers are interface
+        # specific. Think about n interfaces, each with a different
+        # transmission interval, thus the sequence number is
+        # incremented independently.
+        self.sequence_no = 0
+        self.routers = routers
+
+
+    def __contains__(self, router_id):
+        return (self.bits >> router_id) & 1 == 1
+
+
+    def __len__(self):
+        return len(self.order)
+
+
+    def add(self, router_id):
+        if not (self.bits >> router_id) & 1:
+            self.bits |= 1 << router_id
+            self.order.append(router_id)
+
+
+    def discard(self, router_id):
+        if (self.bits >> router_id) & 1:
+            self.bits &= ~(1 << router_id)
+            self.order.remove(router_id)
+
+
+    def neighbors(self):
+        routers = self.routers
+        return [routers[router_id] for router_id in self.order]
+
+
+class NeighborEntry:
+    """last routing packet of a neighbor on one interface"""
+
+    __slots__ = ('rx_time', 'packet')
+
+    def __init__(self, rx_time, packet):
+        self.rx_time = rx_time
+        self.packet = packet
 
 
 class Router:
 
+    __slots__ = ('id', 'ti', 'prefix_v4', '_pos', '_time', 'terminals', '_next_tx_time',
+                 'mm', 'transmitted_now', 'fib', 'fib_version', 'fib_index', 'fib_stale',
+                 '_fib_stale_since', 'route_rx_data', '_expiry_heap', '_expiry_insert_seq',
+                 '_interface_order', 'compressedloss', 'compressedBW', 'neigh_routing_paths')
+
     class MobilityModel:
 
+        __slots__ = ('direction_x', 'direction_y', 'velocity')
+
         LEFT = 1
         RIGHT = 2
         UPWARDS = 1
@@ -102,70 +675,92 @@ class Router:
             return x, y
 
 
-    def __init__(self, id, ti, prefix_v4):
-        self.id = str(id)
-        self._init_log()
+        def is_moving(self):
+            if self.velocity == 0:
+                return False
+            return self.direction_x != 0 or self.direction_y != 0
+
+
+    def __init__(self, id, ti, prefix_v4, routers=None):
+        # integer id, also the key of the router in routers, the mapping
+        # of all routers. It is formatted at the log and render boundary only
+        self.id = id
         self.ti = ti
         self.prefix_v4 = prefix_v4
-        self.pos_x = random.randint(0, SIMU_AREA_X)
-        self.pos_y = random.randint(0, SIMU_AREA_Y)
+        # position is a two element sequence, either a plain list or a
+        # view into the arrays of the VectorizedMobility engine
+        self._pos = [random.randint(0, SIMU_AREA_X), random.randint(0, SIMU_AREA_Y)]
         self.time = 0
         self._print_log_header()
 
-        self._init_terminals_data()
+        self._init_terminals_data(routers)
         self._calc_next_tx_time()
         self.mm = Router.MobilityModel()
         self.transmitted_now = False
         self.fib = dict()
+        # incremented whenever a recalculation changes the FIB
+        self.fib_version = 0
+        self.fib_index = dict()
+        self.fib_stale = False
+        self._fib_stale_since = 0
         self.route_rx_data = dict()
         for interface in ti:
             self.route_rx_data[interface['path_type']] = dict()
+        # one heap item per route_rx_data entry, keyed by the time the
+        # entry is outdated: (rx-time + DEAD_INTERVAL, interface order,
+        # insert order, interface, router id). The rx-time of an entry is
+        # refreshed without touching the heap, a popped item whose entry
+        # was refreshed is pushed again with the new time.
+        self._expiry_heap = list()
+        self._expiry_insert_seq = 0
+        self._interface_order = dict()
+        for i, interface in enumerate(ti):
+            self._interface_order[interface['path_type']] = i
 
 
-    def _print_log_header(self):
-        self._log("Initialize router {}".format(self.id))
-        self._log("  v4 prefix:{}".format(self.prefix_v4))
+    @property
+    def time(self):
+        if CLOCK is None:
+            return self._time
+        return CLOCK.time_of(self.id)
 
 
-    def _log(self, msg):
-        msg = "{:5}: {}\n".format(self.time, msg)
-        self._log_fd.write(msg)
+    @time.setter
+    def time(self, time):
+        self._time = time
 
 
-    def _init_log(self):
-        file_path = os.path.join(PATH_LOGS, "{0:05}.log".format(int(self.id)))
-        self._log_fd = open(file_path, 'w')
+    @property
+    def pos_x(self):
+        return self._pos[0]
 
 
-    def _cmp_dicts(self, dict1, dict2):
-        if dict1 == None or dict2 == None: return False
-        if type(dict1) is not dict or type(dict2) is not dict: return False
-        shared_keys = set(dict2.keys()) & set(dict2.keys())
-        if not len(shared_keys) == len(dict1.keys()) and len(shared_keys) == len(dict2.keys()):
-            return False
-        eq = True
-        for key in dict1.keys():
-            if type(dict1[key]) is dict:
-                if key not in dict2:
-                    return False
-                else:
-                    eq = eq and self._cmp_dicts(dict1[key], dict2[key])
-            else:
-                if key not in dict2:
-                    return False
-                else:
-                    eq = eq and (dict1[key] == dict2[key])
-        return eq
+    @pos_x.setter
+    def pos_x(self, x):
+        self._pos[0] = x
+
+
+    @property
+    def pos_y(self):
+        return self._pos[1]
+
 
+    @pos_y.setter
+    def pos_y(self, y):
+        self._pos[1] = y
 
-    def _cmp_packets(self, packet1, packet2):
-        p1 = copy.deepcopy(packet1)
-        p2 = copy.deepcopy(packet2)
-        # some data may differ, but the content is identical,
-        # zeroize them here out
-        p1['sequence-no'] = 0
-        p2['sequence-no'] = 0
-        return self._cmp_dicts(p1, p2)
+
+    def _print_log_header(self):
+        self._log("Initialize router {}", self.id)
+        self._log("  v4 prefix:{}", self.prefix_v4)
+
+
+    def _log(self, msg, *args, level=LOG_INFO):
+        # msg is formatted with args by the sink, thus only if the
+        # level is enabled
+        if level < LOG_LEVEL or LOG_SINK is None:
+            return
+        LOG_SINK.write(self.id, self.time, msg, args)
 
 
     def _calc_next_tx_time(self):
@@ -180,17 +775,10 @@ class Router:
         self.terminals[path_type].sequence_no += 1
 
 
-    def _init_terminals_data(self):
-        self.terminals = addict.Dict()
+    def _init_terminals_data(self, routers):
+        self.terminals = dict()
         for t in self.ti:
-            self.terminals[t['path_type']] = addict.Dict()
-            self.terminals[t['path_type']].connections = dict()
-            # we initialize and handle as many sequence numbers
-            # as interfaces because sequence numbers are interface
-            # specific. Think about n interfaces, each with a different
-            # transmission interval, thus the sequence number is
-            # incremented independently.
-            self.terminals[t['path_type']].sequence_no = 0
+            self.terminals[t['path_type']] = Terminal(routers)
 
 
     def dist_update(self, dist, other):
@@ -202,37 +790,41 @@ class Router:
             max_range = v['range']
             if dist <= max_range:
                 #print("{} in range:     {} to {} - {} m via {}".format(t, self.id, other.id, dist, t))
-                self.terminals[t].connections[other.id] = other
+                self.terminals[t].add(other.id)
             else:
                 #print("{} out of range: {} to {} - {} m".format(t, self.id, other.id, dist))
-                if other.id in self.terminals[t].connections:
-                    del self.terminals[t].connections[other.id]
+                self.terminals[t].discard(other.id)
 
 
     def _rx_save_routing_data(self, sender, interface, packet):
         route_recalc_required = True
-        if not str(sender.id) in self.route_rx_data[interface]:
+        if not sender.id in self.route_rx_data[interface]:
             # new entry (never seen before) or outdated comes
             # back again
-            self.route_rx_data[interface][str(sender.id)] = dict()
-            global NEIGHBOR_INFO_ACTIVE
-            NEIGHBOR_INFO_ACTIVE += 1
+            self.route_rx_data[interface][sender.id] = NeighborEntry(self.time, packet)
+            item = (self.time + DEAD_INTERVAL, self._interface_order[interface],
+                    self._expiry_insert_seq, interface, sender.id)
+            self._expiry_insert_seq += 1
+            heapq.heappush(self._expiry_heap, item)
         else:
-            self._log("\texisting entry")
+            self._log("\texisting entry", level=LOG_DEBUG)
             # existing entry from neighbor
-            seq_no_last = self.route_rx_data[interface][str(sender.id)]['packet']['sequence-no']
+            seq_no_last = self.route_rx_data[interface][sender.id].packet['sequence-no']
             seq_no_new  = packet['sequence-no']
             if seq_no_new <= seq_no_last:
                 print("receive duplicate or outdated route packet -> ignore it")
                 route_recalc_required = False
                 return route_recalc_required
-            data_equal = self._cmp_packets(self.route_rx_data[interface][str(sender.id)]['packet'], packet)
-            if data_equal:
+            # the content of packets from the same sender is identical if the
+            # FIB version is identical, the sequence number does not count
+            fib_version_last = self.route_rx_data[interface][sender.id].packet['fib-version']
+            if fib_version_last == packet['fib-version']:
                 # packet is identical, we must save the last packet (think update sequence no)
                 # but a route recalculation is not required
                 route_recalc_required = False
-        self.route_rx_data[interface][str(sender.id)]['rx-time'] = self.time
-        self.route_rx_data[interface][str(sender.id)]['packet'] = packet
+        entry = self.route_rx_data[interface][sender.id]
+        entry.rx_time = self.time
+        entry.packet = packet
         #self.route_rx_data[interface][sender.id]['rx-time'] = self.time
         #self.route_rx_data[interface][sender.id]['packet'] = packet
         #self.route_rx_data[interface]={"{}".format(sender.id):{'rx-time':self.time,
@@ -246,22 +838,82 @@ class Router:
 
     def _check_outdated_route_entries(self):
         route_recalc_required = False
-        for interface, v in self.route_rx_data.items():
-            dellist = []
-            for router_id, vv in v.items():
-                if self.time - vv["rx-time"] > DEAD_INTERVAL:
-                    msg = "outdated entry from {} received at {}, interface: {} - drop it"
-                    self._log(msg.format(router_id, vv["rx-time"], interface))
-                    dellist.append(router_id)
-            for id in dellist:
-                route_recalc_required = True
-                del v[id]
-                global NEIGHBOR_INFO_ACTIVE
-                NEIGHBOR_INFO_ACTIVE -= 1
+        heap = self._expiry_heap
+        while heap and heap[0][0] < self.time:
+            item = heapq.heappop(heap)
+            _, order, insert_seq, interface, router_id = item
+            vv = self.route_rx_data[interface][router_id]
+            if self.time - vv.rx_time <= DEAD_INTERVAL:
+                # refreshed in the meantime, not outdated
+                item = (vv.rx_time + DEAD_INTERVAL, order, insert_seq, interface, router_id)
+                heapq.heappush(heap, item)
+                continue
+            msg = "outdated entry from {} received at {}, interface: {} - drop it"
+            self._log(msg, router_id, vv.rx_time, interface)
+            if TRACE is not None:
+                TRACE.record(self.time, self.id, TRACE_EXPIRE, router_id, self._interface_order[interface])
+            route_recalc_required = True
+            del self.route_rx_data[interface][router_id]
         return route_recalc_required
 
 
+    def _route_recalc_request(self):
+        global ROUTE_RECALC_REQUESTS
+        ROUTE_RECALC_REQUESTS += 1
+        if not ROUTE_RECALC_COALESCE:
+            self._recalculate_routing_table()
+            return
+        if not self.fib_stale:
+            self.fib_stale = True
+            self._fib_stale_since = self.time
+
+
+    def recalc_time(self):
+        """time when a stale routing table is recalculated"""
+        return self._fib_stale_since + ROUTE_RECALC_HOLDDOWN
+
+
+    def recalc_due(self):
+        return self.fib_stale and self.time >= self.recalc_time()
+
+
+    def recalc_if_stale(self):
+        if not self.recalc_due():
+            return
+        self.fib_stale = False
+        self._recalculate_routing_table()
+
+
+    def install_fib(self, fib, log_lines):
+        """takes over a FIB calculated by ParallelRecalc, log_lines are the
+        (time, message) tuples logged while calculating it"""
+        for time, msg in log_lines:
+            if LOG_SINK is not None:
+                LOG_SINK.write(self.id, time, msg, ())
+        self.fib_stale = False
+        self._install_fib(fib, self.fib)
+
+
     def _recalculate_routing_table(self):
+        fib_last = self.fib
+        self._install_fib(self._compute_fib(), fib_last)
+
+
+    @classmethod
+    def recalc_shell(cls, id, time, ti, route_rx_data):
+        """router with nothing but the state _compute_fib() reads, used
+        by worker processes of ParallelRecalc"""
+        router = cls.__new__(cls)
+        router.id = id
+        router.time = time
+        router.ti = ti
+        router.route_rx_data = route_rx_data
+        return router
+
+
+    def _compute_fib(self):
+        """calculates the new FIB, not yet frozen. Reads route_rx_data, ti,
+        id and time only, thus it can run in another process"""
         self._log("recalculate routing table")
         self.fib = dict()
         self.compressedloss=dict()
@@ -273,71 +925,90 @@ class Router:
         self.neigh_routing_paths['othernode_paths']=dict()
         self._calc_neigh_routing_paths()
         self._calc_fib()
-
-
-    def rx_route_packet(self, sender, interface, packet):
-        msg = "rx route packet from {}, interface:{}, seq-no:{}"
-        self._log(msg.format(sender.id, interface, packet['sequence-no']))
-        route_recalc_required = self._rx_save_routing_data(sender, interface, packet)
-        if route_recalc_required:
-            self._recalculate_routing_table()
+        # intermediate results, not kept until the next recalculation
+        self.compressedloss = self.compressedBW = self.neigh_routing_paths = None
+        return self.fib
+
+
+    def _install_fib(self, fib, fib_last):
+        global ROUTE_RECALC
+        ROUTE_RECALC += 1
+        # the FIB is advertised without copying, thus it is frozen, unchanged
+        # parts are shared with the last version
+        self.fib = freeze(fib, fib_last)
+        if self.fib is not fib_last:
+            self.fib_version += 1
+            global FIB_LAST_CHANGE
+            FIB_LAST_CHANGE = max(FIB_LAST_CHANGE, self.time)
+            fib_index_last = self.fib_index
+            self._compile_fib()
+            if TRACE is not None:
+                self._trace_route_changes(fib_index_last)
+        if TRACE is not None:
+            TRACE.record(self.time, self.id, TRACE_RECALC, fib_version=self.fib_version)
+
+
+    def _trace_route_changes(self, fib_index_last):
+        # the seq-no column holds the new next hop, -1 if the route is gone
+        for pathtype, event in TRACE_ROUTE_CHANGE.items():
+            index = self.fib_index.get(pathtype, {})
+            index_last = fib_index_last.get(pathtype, {})
+            for dest in sorted(index.keys() | index_last.keys()):
+                entry = index.get(dest)
+                entry_last = index_last.get(dest)
+                if entry is not None and entry_last is not None and entry[:2] == entry_last[:2]:
+                    continue
+                if entry is None:
+                    next_hop, interface = -1, -1
+                else:
+                    next_hop, interface = entry[0], self._interface_order[entry[1]]
+                TRACE.record(self.time, self.id, event, dest, interface, next_hop, self.fib_version)
+
+
+    def _compile_fib(self):
+        """Flat forwarding index per TOS, built once per FIB version:
+        dest -> (next-hop, interface, full path, networks). Destinations
+        whose next hop has no interface entry are left out."""
+        self_id = self.id
+        self.fib_index = dict()
+        for pathtype, table in self.fib.items():
+            index = self.fib_index[pathtype] = dict()
+            for dest, value_dest in table.items():
+                value_self = value_dest.get(self_id)
+                if value_self is None:
+                    continue
+                next_hop = value_self['next-hop']
+                value_next_hop = table.get(next_hop, {}).get(self_id)
+                if value_next_hop is None:
+                    continue
+                interface = None
+                for value_i in value_next_hop['paths'].values():
+                    for key_ii in value_i:
+                        interface = key_ii
+                        break
+                if interface is None:
+                    continue
+                full_path = value_self.get('full_path', value_self['paths'])
+                index[dest] = (next_hop, interface, full_path, value_self['networks'])
 
 
     def _lookup(self, dest_id, pathtype):
-        if len(self.fib) < 1:
-            return None, None
-        lookup_data=dict()
-        self_id=str(self.id)
-        dest_found=False
-        self._log(pprint.pformat(self.fib))
-        #pprint.pprint(self.fib)
-        for key_dest,value_dest in self.fib[pathtype].items():
-            if key_dest==dest_id:
-               for key_self,value_self in value_dest.items():
-                   if key_self==self_id:
-                      lookup_data['next-hop']=value_self['next-hop']
-                      lookup_data['dest_network']=list()
-                      lookup_data['dest_network']=value_self['networks']
-                      fullpath_found=False
-                      for key_path, value_path in value_self.items():
-                          if key_path=='full_path':
-                             lookup_data['full_path']=list()
-                             lookup_data['full_path']=value_path
-                             fullpath_found=True
-                             break
-                      if fullpath_found==False:
-                         lookup_data['full_path']=value_self['paths']
-               dest_found=True
-               break
-        self._log(pprint.pformat(lookup_data))
-        #pprint.pprint(lookup_data)
-        if len(lookup_data)<=0:
+        entry = self.fib_index.get(pathtype, {}).get(dest_id)
+        if entry is None:
+            self._log('path to {} is not available with this pathtype', dest_id)
             return None, None
-
-        for key_dest,value_dest in self.fib[pathtype].items():
-               if key_dest==lookup_data['next-hop']:
-                  for key_self,value_self in value_dest.items():
-                      if key_self==self_id:
-                         for key_i,value_i in value_self['paths'].items():
-                             for key_ii, value_ii in value_i.items():
-                                 lookup_data['interface']=key_ii
-                                 break
-
-        if dest_found==False:
-           self._log('path to {} is not available with this pathtype'.format(dest_id))
-           return None, None
-        #pprint.pprint(self.fib)
-        #print(lookup_data['next-hop'],lookup_data['interface'])
-        return lookup_data['next-hop'],lookup_data['interface']
+        msg = "lookup {} ({}): next-hop:{} interface:{} full-path:{}"
+        self._log(msg, dest_id, pathtype, entry[0], entry[1], entry[2], level=LOG_DEBUG)
+        return entry[0], entry[1]
 
 
     def _calc_neigh_routing_paths(self):
         for key_i,value_i in self.route_rx_data.items():
             for key_s,value_s in value_i.items():
                 self._add_all_neighs(key_i,value_i,key_s,value_s)
-                if len(value_s['packet']['routingpaths'])>0:
+                if len(value_s.packet['routingpaths'])>0:
                    self._add_all_othernodes(key_i,value_i,key_s,value_s)
-        self._log(pprint.pformat(self.neigh_routing_paths))
+        self._log("{}", LazyPFormat(self.neigh_routing_paths), level=LOG_DEBUG)
         #pprint.pprint(self.neigh_routing_paths)
 
     def _add_all_neighs(self,key_i,value_i,key_s,value_s):
@@ -346,12 +1017,12 @@ class Router:
            for key_r,value_r in self.neigh_routing_paths['neighs'].items():
                if key_r == key_s:
                   path_found = False
-                  for valuevalue_r in value_r['paths']["{}->{}".format(self.id,key_r)]:
+                  for valuevalue_r in value_r['paths'][(self.id,key_r)]:
                       if valuevalue_r == key_i:
                          path_found = True
                          break
                   if path_found == False:
-                     value_r['paths']["{}->{}".format(self.id,key_r)].append(key_i)
+                     value_r['paths'][(self.id,key_r)].append(key_i)
                   found_neigh = True
                   break
            if found_neigh == False:
@@ -360,25 +1031,25 @@ class Router:
             self._add_neigh_entries(key_s, key_i, value_s)
 
     def _add_all_othernodes(self,key_i,value_i,key_s,value_s):
-        self_id=str(self.id)
+        self_id=self.id
         if len(self.neigh_routing_paths['othernode_paths']) > 0:
            found_pathtype=False
-           for key_path,value_path in value_s['packet']['routingpaths'].items():
+           for key_path,value_path in value_s.packet['routingpaths'].items():
                for key_pathtype,value_pathtype in self.neigh_routing_paths['othernode_paths'].items():
                    if key_path == key_pathtype:
                       found_dest=False
                       for key_dest_r,value_dest_r in value_path.items():
                           if key_dest_r==self_id:
-                             self._log("skip self routing {} {}".format(key_dest_r,self_id))
-                             self._log(pprint.pformat(value_dest_r))
+                             self._log("skip self routing {} {}", key_dest_r, self_id, level=LOG_DEBUG)
+                             self._log("{}", LazyPFormat(value_dest_r), level=LOG_DEBUG)
                           else:
                                for key_dest_n,value_dest_n in value_pathtype.items():
                                    if key_dest_r==key_dest_n:
                                       found_node=False
                                       for key_send,value_send in value_dest_r.items():
                                           if key_send==self_id:
-                                             self._log("Existing neighbour {} {}".format(key_send,self_id))
-                                             self._log(pprint.pformat(value_send))
+                                             self._log("Existing neighbour {} {}", key_send, self_id, level=LOG_DEBUG)
+                                             self._log("{}", LazyPFormat(value_send), level=LOG_DEBUG)
                                           else:
                                                for key_node,value_node in value_dest_n.items():
                                                    if key_send == key_node:
@@ -387,10 +1058,13 @@ class Router:
                                                       found_node=True
                                                       break
                                                if found_node==False:
+                                                  value_pathtype = thaw(self.neigh_routing_paths['othernode_paths'], key_pathtype)
+                                                  value_dest_n = thaw(value_pathtype, key_dest_n)
                                                   value_dest_n[key_send]=value_send
                                       found_dest=True
                                       break
                                if found_dest==False:
+                                  value_pathtype = thaw(self.neigh_routing_paths['othernode_paths'], key_pathtype)
                                   value_pathtype[key_dest_r]=value_dest_r
                       found_pathtype=True
                       break
@@ -398,13 +1072,15 @@ class Router:
                   self.neigh_routing_paths['othernode_paths'][key_path]=value_path
 
         else:
-             self._log('Adding first entry')
-             self.neigh_routing_paths['othernode_paths'] = value_s['packet']['routingpaths']
+             self._log('Adding first entry', level=LOG_DEBUG)
+             # advertised routing paths are read-only snapshots, they are
+             # copied level by level on write, see thaw()
+             self.neigh_routing_paths['othernode_paths'] = dict(value_s.packet['routingpaths'])
 
     def _add_neigh_entries(self, key_s, key_i, value_s):
         self.neigh_routing_paths['neighs'][key_s] ={'next-hop':key_s,
-                                                'networks':value_s['packet']['networks'],
-                                                 'paths':{"{}->{}".format(self.id,key_s):[key_i]}
+                                                'networks':value_s.packet['networks'],
+                                                 'paths':{(self.id,key_s):[key_i]}
                                                }
 
         self.neigh_routing_paths['paths']=dict()
@@ -413,8 +1089,7 @@ class Router:
                                                                   'bandwidth':p['bandwidth']
                                                                 }
     def _calc_fib(self):
-        import networkx as nx
-        G = nx.Graph()
+        engine = PathEngine()
         weigh_loss = dict()
         weigh_bandwidth = dict()
         for key_n,value_n in self.neigh_routing_paths['neighs'].items():
@@ -425,40 +1100,37 @@ class Router:
         self.add_fib_lowloss_neighs()
         self.add_fib_highBW_neighs()
         if len(self.neigh_routing_paths['othernode_paths'])>0:
-           self._calc_shortestpath_loss(G,nx)
-           self._calc_widestpath_BW(G,nx)
-        self._log(pprint.pformat(self.fib))
+           self._calc_shortestpath_loss(engine)
+           self._calc_widestpath_BW(engine)
+        self._log("{}", LazyPFormat(self.fib), level=LOG_DEBUG)
         #pprint.pprint(self.fib)
 
-    def _calc_shortestpath_loss(self,G,nx):
-        self_id=str(self.id)
+    def _calc_shortestpath_loss(self,engine):
+        self_id=self.id
         dest_array=list()
         for key_neigh,value_neigh in self.compressedloss.items():
             for key_path,value_path in value_neigh[self_id]['paths'].items():
                 for key_weigh,value_weigh in value_path.items():
-                     G.add_edge(key_neigh,self_id,weight=value_weigh)
+                     engine.add_edge('low_loss',key_neigh,self_id,value_weigh)
         for key_dest,value_dest in self.neigh_routing_paths['othernode_paths']['low_loss'].items():
             for key_node,value_node in value_dest.items():
                 if key_node==self_id:
-                   self._log("it knows the route only through me so ignore to avoid looping")
+                   self._log("it knows the route only through me so ignore to avoid looping", level=LOG_DEBUG)
                 else:
                      for key_path,value_path in value_node['paths'].items():
                          for key_loss,value_loss in value_path.items():
                              if key_path[0]==self_id:
-                                self._log("it knows the route only through me so ignore to avoid looping")
+                                self._log("it knows the route only through me so ignore to avoid looping", level=LOG_DEBUG)
                              else:
-                                  G.add_edge(key_path[3],key_path[0],weight=value_loss)
+                                  engine.add_edge('low_loss',key_path[1],key_path[0],value_loss)
             dest_array.append(key_dest)
+        pred = engine.shortest_paths('low_loss', self_id)
         for dest in dest_array:
-            path_array=list()
             if self_id==dest:
-               self._log('source and target are same {}-{}'.format(self_id,dest))
+               self._log('source and target are same {}-{}', self_id, dest, level=LOG_DEBUG)
             else:
-                 try:
-                     path_array = nx.shortest_path(G, dest, self_id, weight='weight')
-                 except KeyError:
-                     continue
-                 except nx.exception.NetworkXNoPath:
+                 path_array = PathEngine.path_to_source(pred, dest)
+                 if path_array is None:
                      continue
                  if len(path_array)>2:
                      self.add_shortestloss_path(path_array,self_id)
@@ -466,7 +1138,7 @@ class Router:
     def add_shortestloss_path(self,path_array,self_id):
         next_hop_index=(len(path_array))-2
         full_path=path_array[::-1]
-        self.fib['low_loss'][path_array[0]]={"{}".format(self.id):{'next-hop':path_array[next_hop_index],
+        self.fib['low_loss'][path_array[0]]={self.id:{'next-hop':path_array[next_hop_index],
                                                                    'full_path':full_path}}
 
         for key_i,value_i in self.neigh_routing_paths['othernode_paths']['low_loss'][path_array[0]].items():
@@ -490,44 +1162,42 @@ class Router:
                          #break
                   #break
 
-    def _calc_widestpath_BW(self,G,nx):
-        self_id=str(self.id)
+    def _calc_widestpath_BW(self,engine):
+        self_id=self.id
         dest_array=list()
         for key_neigh,value_neigh in self.compressedBW.items():
             for key_path,value_path in value_neigh[self_id]['paths'].items():
                 for key_weigh,value_weigh in value_path.items():
-                    G.add_edge(key_neigh,self_id,weight=value_weigh)
+                    engine.add_edge('high_bandwidth',key_neigh,self_id,value_weigh)
         for key_dest,value_dest in self.neigh_routing_paths['othernode_paths']['high_bandwidth'].items():
             for key_node,value_node in value_dest.items():
                 if key_node==self_id:
-                   self._log("it knows the route only through me so ignore to avoid looping")
+                   self._log("it knows the route only through me so ignore to avoid looping", level=LOG_DEBUG)
                 else:
                      for key_path,value_path in value_node['paths'].items():
                          for key_loss,value_loss in value_path.items():
                              if key_path[0]==self_id:
-                                self._log("it knows the route only through me so ignore to avoid looping")
+                                self._log("it knows the route only through me so ignore to avoid looping", level=LOG_DEBUG)
                              else:
-                                G.add_edge(key_path[3],key_path[0],weight=value_loss)
-                                self._log("{} {} {}".format(key_path[0],key_path[3],value_loss))
+                                engine.add_edge('high_bandwidth',key_path[1],key_path[0],value_loss)
+                                self._log("{} {} {}", key_path[0], key_path[1], value_loss, level=LOG_DEBUG)
             dest_array.append(key_dest)
-        self._log(dest_array)
+        self._log("{}", dest_array, level=LOG_DEBUG)
+        trees = engine.widest_paths('high_bandwidth', self_id)
         for dest in dest_array:
-            path_array=list()
             if self_id==dest:
-               self._log('source and target are same {} {}'.format(self_id,dest))
-            else:
-                 try:
-                     path_array = nx.shortest_path(G, dest, self_id, weight='weight')
-                 except KeyError:
+               self._log('source and target are same {} {}', self_id, dest, level=LOG_DEBUG)
+            elif dest in trees:
+                 path_array = PathEngine.path_to_source(trees[dest], dest)
+                 if path_array is None:
                      continue
-                 except nx.exception.NetworkXNoPath:
-                     continue
-                 if len(path_array)>2:                                                                                                                      self.add_widestBW_path(path_array,self_id)
+                 if len(path_array)>2:
+                     self.add_widestBW_path(path_array,self_id)
 
     def add_widestBW_path(self,path_array,self_id):
         next_hop_index=(len(path_array))-2
         full_path=path_array[::-1]
-        self.fib['high_bandwidth'][path_array[0]]={"{}".format(self.id):{'next-hop':path_array[next_hop_index],
+        self.fib['high_bandwidth'][path_array[0]]={self.id:{'next-hop':path_array[next_hop_index],
                                                                          'full_path':full_path}}
         for key_i,value_i in self.neigh_routing_paths['othernode_paths']['high_bandwidth'][path_array[0]].items():
             self.fib['high_bandwidth'][path_array[0]][self_id]['networks']=list()
@@ -584,17 +1254,17 @@ class Router:
         #pprint.pprint(self.compressedBW)
 
     def add_loss_entry(self,key_n,value_n,weigh_loss):
-        self.compressedloss[key_n]={"{}".format(self.id):{'next-hop':value_n['next-hop'],
+        self.compressedloss[key_n]={self.id:{'next-hop':value_n['next-hop'],
                                      'networks':value_n['networks'],
-                                     'paths':{"{}->{}".format(self.id,key_n):dict()},
-                                     'paths':{"{}->{}".format(self.id,key_n):weigh_loss}
+                                     'paths':{(self.id,key_n):dict()},
+                                     'paths':{(self.id,key_n):weigh_loss}
                                      }}
 
     def add_bandwidth_entry(self,key_n,value_n,weigh_bandwidth):
-        self.compressedBW[key_n]={"{}".format(self.id):{'next-hop':value_n['next-hop'],
+        self.compressedBW[key_n]={self.id:{'next-hop':value_n['next-hop'],
                                            'networks':value_n['networks'],
-                                           'paths':{"{}->{}".format(self.id,key_n):dict()},
-                                           'paths':{"{}->{}".format(self.id,key_n):weigh_bandwidth}
+                                           'paths':{(self.id,key_n):dict()},
+                                           'paths':{(self.id,key_n):weigh_bandwidth}
                                            }}
 
     def _loss_path_compression(self,key_n,value_n):
@@ -631,12 +1301,34 @@ class Router:
 
 
     def rx_route_packet(self, sender, interface, packet):
+        if self._rx_route_packet(sender, interface, packet):
+            self._route_recalc_request()
+
+
+    def rx_route_packets(self, packets):
+        """receives a batch of (sender, interface, packet) delivered by the
+        Medium, the routing table is recalculated once for all of them"""
+        route_recalc_required = False
+        for sender, interface, packet in packets:
+            if self._rx_route_packet(sender, interface, packet):
+                route_recalc_required = True
+        if route_recalc_required:
+            self._route_recalc_request()
+
+
+    def _rx_route_packet(self, sender, interface, packet):
         msg = "rx route packet from {}, interface:{}, seq-no:{}"
-        self._log(msg.format(sender.id, interface, packet['sequence-no']))
+        self._log(msg, sender.id, interface, packet['sequence-no'])
+        if TRACE is not None:
+            TRACE.record(self.time, self.id, TRACE_ROUTE_RX, sender.id, self._interface_order[interface],
+                         packet['sequence-no'], packet['fib-version'])
         #pprint.pprint(packet)
         route_recalc_required = self._rx_save_routing_data(sender, interface, packet)
-        if route_recalc_required:
-            self._recalculate_routing_table()
+        if INSTR is not None:
+            INSTR.counters["route-rx " + interface] += 1
+            if not route_recalc_required:
+                INSTR.counters["route-rx unchanged"] += 1
+        return route_recalc_required
 
     def create_routing_packet(self, path_type):
         packet = dict()
@@ -648,6 +1340,9 @@ class Router:
         self._sequence_no_inc(path_type)
         packet['networks'] = list()
         packet['networks'].append({"v4-prefix" : self.prefix_v4})
+        # content fingerprint: the prefix is constant, thus a changed FIB
+        # version is the only possible content change
+        packet['fib-version'] = self.fib_version
         if len(self.fib)>0:
            packet['routingpaths']=self.fib
         return packet
@@ -660,68 +1355,131 @@ class Router:
         for v in self.ti:
             interface = v['path_type']
             packet = self.create_routing_packet(interface)
-            for other_id, other_router in self.terminals[interface].connections.items():
+            if TRACE is not None:
+                TRACE.record(self.time, self.id, TRACE_ROUTE_TX, -1, self._interface_order[interface],
+                             packet['sequence-no'], self.fib_version)
+            if INSTR is not None:
+                INSTR.counters["route-tx " + interface] += 1
+            if MEDIUM is not None:
+                MEDIUM.transmit(self, interface, packet, self.terminals[interface].neighbors())
+                continue
+            for other_router in self.terminals[interface].neighbors():
                 """ this is the multicast packet transmission process """
                 #print(" to router {} [{}]".format(other_id, t))
                 other_router.rx_route_packet(self, interface, packet)
 
 
-    def forward_data_packet(self, packet):
-        packet.ttl -= 0
-        if packet.ttl <= 0:
-            print("TTL 0 reached, routing loop detected!!!")
-            return
-        if str(packet.dst_id) == str(self.id):
-            print("REACHED DESTINATION")
-            return
-        # do a route FIB lookup to each dst_id
-        # and forward data to this router. If no
-        # route can be found then
-        # a) the destination is out of range
-        # b) route table has a bug
-        dst_id = packet.dst_id
-        src_id = packet.src_id
-        next_hop_addr,interface = self._lookup(str(dst_id), packet.tos)
-        if next_hop_addr == None:
-            print("{}: ICMP - no route to host for packet dst {}, drop packet".format(self.id, dst_id))
-            return
-        print("{}: packet src:{} dst:{}".format(self.id, src_id, dst_id))
-        print("  current:{} nexthop: {}".format(self.id, next_hop_addr))
-        print("  TOS: {} (packet prefered way)".format(packet.tos))
-        # FIXME: use rx_data_packet() instead of ..forward_data_packet
-        #print(interface)
-        #print(next_hop_addr)
-       # pprint.pprint(self.terminals)
-        self.terminals[interface].connections[next_hop_addr].forward_data_packet(packet)
+    def forward_data_packet(self, dst_id, tos, count=1, ttl=DEFAULT_PACKET_TTL, path=None):
+        """Forwards count packets of one flow hop by hop from this router,
+        they all take the same path. Returns (result, hops), result is
+        'delivered' or the drop reason: 'no-route', 'unreachable', 'ttl'
+        or 'loop'. If path is a list, the routers passed are appended as
+        (router, FIB version, interface, next hop), see PathCache."""
+        global DATA_DELIVERED, DATA_DROPPED, DATA_LOOPS
+        router = self
+        visited = set()
+        hops = 0
+        while router.id != dst_id:
+            if ttl <= 0:
+                result = 'ttl'
+                break
+            if router.id in visited:
+                result = 'loop'
+                DATA_LOOPS += count
+                break
+            visited.add(router.id)
+            next_hop_addr, interface = router._lookup(dst_id, tos)
+            if next_hop_addr is None:
+                result = 'no-route'
+                break
+            if path is not None:
+                path.append((router, router.fib_version, interface, next_hop_addr))
+            if TRACE is not None:
+                TRACE.record(router.time, router.id, TRACE_DATA_FWD, next_hop_addr,
+                             router._interface_order[interface])
+            terminal = router.terminals[interface]
+            if next_hop_addr not in terminal:
+                # the next hop moved out of range, the route is not yet expired
+                result = 'unreachable'
+                break
+            router = terminal.routers[next_hop_addr]
+            ttl -= 1
+            hops += 1
+        if path is not None:
+            path.append((router, router.fib_version, None, None))
+        if router.id == dst_id:
+            DATA_DELIVERED += count
+            if TRACE is not None:
+                TRACE.record(router.time, router.id, TRACE_DATA_DELIVER, self.id)
+            return 'delivered', hops
+        DATA_DROPPED += count
+        if TRACE is not None:
+            TRACE.record(router.time, router.id, TRACE_DATA_DROP, dst_id)
+        return result, hops
+
+
+    def forward_cached(self, dst_id, entry, count=1):
+        """forward_data_packet() along a path of the PathCache, without
+        FIB lookups"""
+        global DATA_DELIVERED, DATA_DROPPED, DATA_LOOPS
+        result, hops, path = entry
+        router = path[-1][0]
+        if TRACE is not None:
+            for hop, _, interface, next_hop_addr in path[:-1]:
+                TRACE.record(hop.time, hop.id, TRACE_DATA_FWD, next_hop_addr, hop._interface_order[interface])
+        if result == 'delivered':
+            DATA_DELIVERED += count
+            if TRACE is not None:
+                TRACE.record(router.time, router.id, TRACE_DATA_DELIVER, self.id)
+            return result, hops
+        if result == 'loop':
+            DATA_LOOPS += count
+        DATA_DROPPED += count
+        if TRACE is not None:
+            TRACE.record(router.time, router.id, TRACE_DATA_DROP, dst_id)
+        return result, hops
 
 
+    def pos(self):
+        return self.pos_x, self.pos_y
 
-    def rx_data_packet(self, sender, interface, packet):
-        print("{} receive data packet from {}".format(self.id, sender.id))
-        if dst_id == self.id:
-            print("FINISH, packet received at destination")
-        else:
-            if packet.ttl <= 0:
-                print("TTL 0 reached, routing loop detected!!!")
-                return
-            packet.ttl -= 0
-            self.forward_data_packet(packet)
 
+    def move(self):
+        # routers driven by the VectorizedMobility engine have no
+        # mobility model, they are moved in one batch
+        if self.mm is not None:
+            self.pos_x, self.pos_y = self.mm.move(self.pos_x, self.pos_y)
 
-    def pos(self):
-        return self.pos_x, self.pos_y
+
+    def expire_route_entries(self):
+        route_recalc_required = self._check_outdated_route_entries()
+        if route_recalc_required:
+            self._route_recalc_request()
+
+
+    def next_expiry_time(self):
+        """time when the oldest received routing data is outdated, None
+        if no routing data is stored"""
+        if not self._expiry_heap:
+            return None
+        # lower bound only, the entry may have been refreshed since
+        return self._expiry_heap[0][0] + 1
+
+
+    def tx_timer(self):
+        # never advertise a stale routing table, except within hold-down
+        self.recalc_if_stale()
+        self.tx_route_packet()
+        self._calc_next_tx_time()
 
 
     def step(self):
         self.time += 1
-        self.pos_x, self.pos_y = self.mm.move(self.pos_x, self.pos_y)
-        route_recalc_required = self._check_outdated_route_entries()
-        if route_recalc_required:
-            self._recalculate_routing_table()
+        self.move()
+        self.expire_route_entries()
 
         if self.time == self._next_tx_time:
-            self.tx_route_packet()
-            self._calc_next_tx_time()
+            self.tx_timer()
             self.transmitted_now = True
         else:
             self.transmitted_now = False
@@ -737,56 +1495,492 @@ def rand_ip_prefix(type_):
     return c
 
 
-def dist_update_all(r):
-    for i in range(NO_ROUTER):
-        for j in range(NO_ROUTER):
-            if i == j: continue
+class SpatialIndex:
+    """Uniform grid over the simulation area. The cell edge length is the
+    largest interface range, thus two routers in range of each other are
+    always located in the same or in adjacent cells. Only routers which
+    moved since the last update are re-evaluated."""
+
+    def __init__(self, r):
+        self.cell_size = max(t['range'] for router in r.values() for t in router.ti)
+        self.cells = dict()
+        self.router_cell = dict()
+        self.last_pos = dict()
+
+
+    def _cell(self, pos):
+        return int(pos[0] // self.cell_size), int(pos[1] // self.cell_size)
+
+
+    def _relocate(self, i, cell):
+        old_cell = self.router_cell.get(i)
+        if old_cell == cell:
+            return
+        if old_cell is not None:
+            self.cells[old_cell].discard(i)
+            if not self.cells[old_cell]:
+                del self.cells[old_cell]
+        self.cells.setdefault(cell, set()).add(i)
+        self.router_cell[i] = cell
+
+
+    def _moved(self, r, ids):
+        moved = list()
+        for i in ids:
+            pos = r[i].pos()
+            if self.last_pos.get(i) == pos:
+                continue
+            self.last_pos[i] = pos
+            self._relocate(i, self._cell(pos))
+            moved.append(i)
+        return moved
+
+
+    def _candidates(self, i, router):
+        cx, cy = self.router_cell[i]
+        candidates = set()
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                candidates.update(self.cells.get((cx + dx, cy + dy), ()))
+        # routers connected so far but now outside of the adjacent
+        # cells must be visited too, they are out of range now
+        for terminal in router.terminals.values():
+            candidates.update(terminal.order)
+        candidates.discard(i)
+        return candidates
+
+
+    def update(self, r, ids=None):
+        """ids limits the update to these routers, the others must not
+        have moved since the last update"""
+        pairs = set()
+        for i in self._moved(r, r if ids is None else ids):
+            for j in self._candidates(i, r[i]):
+                pairs.add((i, j) if i < j else (j, i))
+        # sorted, so that new connections are added in the same order as
+        # a full pairwise scan would add them
+        for i, j in sorted(pairs):
             i_pos = r[i].pos()
             j_pos = r[j].pos()
             dist = math.hypot(i_pos[1] - j_pos[1], i_pos[0] - j_pos[0])
             r[j].dist_update(dist, r[i])
+            r[i].dist_update(dist, r[j])
 
 
-def draw_router_loc(r, path, img_idx):
-    c_links = { 'tetra00' : (1.0, 0.15, 0.15, 1.0),  'wifi00' :(0.15, 1.0, 0.15, 1.0)}
-    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, SIMU_AREA_X, SIMU_AREA_Y)
-    ctx = cairo.Context(surface)
-    ctx.rectangle(0, 0, SIMU_AREA_X, SIMU_AREA_Y)
-    ctx.set_source_rgba(0.15, 0.15, 0.15, 1.0)
-    ctx.fill()
+def dist_update_all(r, index):
+    index.update(r)
+
+
+class Medium:
+    """Shared broadcast medium of the route packets. A transmission is
+    queued on its interface together with the receivers in range at
+    transmit time and delivered in the receive phase of the tick it is
+    due, after all routers transmitted. Every receiver gets the packets
+    due in a phase as one batch, grouped by sender in transmit order, and
+    requests one routing table recalculation for all of them. With loss,
+    every reception is dropped with the loss of the interface table in
+    percent; the random draws are done per interface and phase in one
+    batch, with NumPy if vectorized."""
 
+    def __init__(self, ti, seed, delay=0, loss=False, vectorized=False):
+        self.ti = ti
+        self.delay = delay
+        self.loss = loss
+        # interface -> heap of (due time, transmit order, sender, packet, receivers)
+        self.queues = dict()
+        for t in ti:
+            self.queues[t['path_type']] = list()
+        self._transmit_seq = 0
+        self.vectorized = vectorized
+        if vectorized:
+            import numpy as np
+            self.random = np.random.default_rng(seed)
+        else:
+            self.random = random.Random(seed)
+        self.received = 0
+        self.lost = 0
+
+
+    def propagation_delay(self, sender, interface):
+        """delay of a transmission in seconds, hook for delay models; the
+        default is the constant --propagation-delay"""
+        return self.delay
+
+
+    def transmit(self, sender, interface, packet, receivers):
+        if not receivers:
+            return
+        due = sender.time + self.propagation_delay(sender, interface)
+        item = (due, self._transmit_seq, sender, packet, receivers)
+        self._transmit_seq += 1
+        heapq.heappush(self.queues[interface], item)
+
+
+    def _received(self, loss, count):
+        """one flag per reception, False if it is lost"""
+        if self.vectorized:
+            return (self.random.random(count) >= loss).tolist()
+        rnd = self.random.random
+        return [rnd() >= loss for _ in range(count)]
+
+
+    def deliver(self, now):
+        # receiver id -> (receiver, [(transmit order, sender, interface, packet)])
+        batches = dict()
+        for t in self.ti:
+            interface = t['path_type']
+            queue = self.queues[interface]
+            receptions = list()
+            while queue and queue[0][0] <= now:
+                _, seq, sender, packet, receivers = heapq.heappop(queue)
+                for receiver in receivers:
+                    receptions.append((seq, sender, packet, receiver))
+            if not receptions:
+                continue
+            if self.loss and t['loss'] > 0:
+                received = self._received(t['loss'] / 100, len(receptions))
+                lost = len(receptions)
+                receptions = list(itertools.compress(receptions, received))
+                lost -= len(receptions)
+                self.lost += lost
+                if INSTR is not None:
+                    INSTR.counters["medium-lost " + interface] += lost
+            self.received += len(receptions)
+            for seq, sender, packet, receiver in receptions:
+                batch = batches.setdefault(receiver.id, (receiver, list()))[1]
+                batch.append((seq, sender, interface, packet))
+        for receiver_id in sorted(batches):
+            receiver, batch = batches[receiver_id]
+            # the transmissions of a sender are queued in a row
+            batch.sort(key=lambda item: item[0])
+            receiver.rx_route_packets([(sender, interface, packet) for _, sender, interface, packet in batch])
+
+
+class VectorizedMobility:
+    """Struct-of-arrays router state: positions, directions and velocities
+    of all routers live in NumPy arrays. All routers are moved in one
+    batched operation and the in-range matrices are computed in one shot
+    per interface. Routers keep a view into the position array, their
+    MobilityModel is taken over by this engine."""
+
+    # rows are processed in blocks to bound the size of the
+    # temporary distance matrix
+    BLOCK_SIZE = 1024
+
+    def __init__(self, r):
+        import numpy as np
+        self.np = np
+        self.routers = [r[i] for i in sorted(r)]
+        n = len(self.routers)
+        self.pos = np.zeros((n, 2), dtype=np.int64)
+        self.direction = np.zeros((n, 2), dtype=np.int8)
+        self.velocity = np.zeros(n, dtype=np.int64)
+        for i, router in enumerate(self.routers):
+            self.pos[i] = router.pos()
+            self.direction[i] = router.mm.direction_x, router.mm.direction_y
+            self.velocity[i] = router.mm.velocity
+            router._pos = self.pos[i]
+            router.mm = None
+        # in range matrix of the last update, per interface
+        self.in_range = dict()
+        for t in self.routers[0].ti:
+            self.in_range[t['path_type']] = np.zeros((n, n), dtype=bool)
+
+
+    def __getstate__(self):
+        # the module is imported again on restore
+        state = dict(self.__dict__)
+        del state['np']
+        return state
+
+
+    def __setstate__(self, state):
+        import numpy as np
+        self.__dict__.update(state)
+        self.np = np
+        # routers were pickled with copies of their positions, they are
+        # views into pos again. The routers are restored completely before,
+        # they do not refer to the engine.
+        for i, router in enumerate(self.routers):
+            router._pos = self.pos[i]
+
+
+    def move(self):
+        np = self.np
+        x = self.pos[:, 0]
+        y = self.pos[:, 1]
+        dir_x = self.direction[:, 0]
+        dir_y = self.direction[:, 1]
+
+        left = dir_x == Router.MobilityModel.LEFT
+        right = dir_x == Router.MobilityModel.RIGHT
+        x -= self.velocity * left
+        x += self.velocity * right
+        bounce = left & (x <= 0)
+        dir_x[bounce] = Router.MobilityModel.RIGHT
+        x[bounce] = 0
+        bounce = right & (x >= SIMU_AREA_X)
+        dir_x[bounce] = Router.MobilityModel.LEFT
+        x[bounce] = SIMU_AREA_X
+
+        down = dir_y == Router.MobilityModel.DOWNWARDS
+        up = dir_y == Router.MobilityModel.UPWARDS
+        y += self.velocity * down
+        y -= self.velocity * up
+        bounce = down & (y >= SIMU_AREA_Y)
+        dir_y[bounce] = Router.MobilityModel.UPWARDS
+        y[bounce] = SIMU_AREA_Y
+        bounce = up & (y <= 0)
+        dir_y[bounce] = Router.MobilityModel.DOWNWARDS
+        y[bounce] = 0
+
+
+    def is_moving(self):
+        moving = (self.direction != 0).any(axis=1) & (self.velocity != 0)
+        return bool(moving.any())
+
+
+    def _dist_squared(self, start, end):
+        delta = self.pos[start:end, None, :] - self.pos[None, :, :]
+        return (delta * delta).sum(axis=2)
+
+
+    def dist_update(self):
+        """Same result as dist_update_all(), distances are compared squared
+        on integer positions, thus exactly"""
+        np = self.np
+        n = len(self.routers)
+        ti = self.routers[0].ti
+        for start in range(0, n, self.BLOCK_SIZE):
+            end = min(start + self.BLOCK_SIZE, n)
+            dist = self._dist_squared(start, end)
+            # a router is never connected to itself
+            dist[np.arange(end - start), np.arange(start, end)] = -1
+            for t in ti:
+                path_type = t['path_type']
+                in_range = (dist >= 0) & (dist <= t['range'] ** 2)
+                old = self.in_range[path_type][start:end]
+                # row major order, thus new connections are added in the
+                # same order as the full pairwise scan adds them
+                for j, i in zip(*np.nonzero(in_range != old)):
+                    receiver = self.routers[start + j]
+                    other = self.routers[i]
+                    if in_range[j, i]:
+                        receiver.terminals[path_type].add(other.id)
+                    else:
+                        receiver.terminals[path_type].discard(other.id)
+                old[...] = in_range
+
+
+class EventScheduler:
+    """Discrete event core. Route packet transmissions, dead interval
+    expiries, mobility updates, the packets of every flow and the per
+    second output are timestamped events in a priority queue; the
+    simulation jumps from one event to the next instead of polling every
+    router every second. Event times are plain numbers, sub-second times
+    are possible.
+
+    Events at the same time are processed in the order of the per second
+    polling loop, thus both loops give the same result: the expiry and
+    transmit events of the routers in router order, then mobility, the
+    coalesced recalculations in router order, the flows in flow order and
+    the output. The scheduler is the clock of the routers (CLOCK), a
+    router reads the time it would have in the polling loop from it,
+    where routers after the one in turn are still one second behind.
+    Routers and flows are visited by their own events only; mobility
+    events move the moving routers and update their distances only, flows
+    are not scheduled for the ticks they send nothing in. See
+    mdvrd-bench.py event-driven for a comparison of both loops."""
+
+    EXPIRY = 0
+    ROUTE_TX = 1
+    MOBILITY = 2
+    RECALC = 3
+    FLOW = 4
+    TICK = 5
+    # phase of every event kind, the heap is ordered by time, phase,
+    # router or flow index and kind
+    PHASE = {EXPIRY: 0, ROUTE_TX: 0, MOBILITY: 1, RECALC: 2, FLOW: 3, TICK: 4}
+
+    def __init__(self, r, mobility_update, tick, traffic, mobility_interval=1, tick_interval=1):
+        self.r = r
+        self.mobility_update = mobility_update
+        self.tick = tick
+        self.traffic = traffic
+        self.mobility_interval = mobility_interval
+        self.tick_interval = tick_interval
+        self.queue = list()
+        self._seq = itertools.count()
+        self.now = 0
+        # router whose expiry or transmit event is processed, the routers
+        # after it are one second behind
+        self.in_turn = math.inf
+        # per router time of the pending expiry event, at most one
+        # is queued for each router
+        self.expiry_pending = dict()
+        self.recalc_pending = set()
+        # routers which transmitted since the last output
+        self.transmitted = list()
+        self.events_processed = 0
+
+
+    def time_of(self, router_id):
+        return self.now - 1 if router_id > self.in_turn else self.now
+
+
+    def schedule(self, time, kind, index=None):
+        order = -1 if index is None else index
+        item = (time, EventScheduler.PHASE[kind], order, kind, next(self._seq), index)
+        heapq.heappush(self.queue, item)
+
+
+    def _schedule_expiry(self, i):
+        if i in self.expiry_pending:
+            return
+        expiry_time = self.r[i].next_expiry_time()
+        if expiry_time is None:
+            return
+        self.expiry_pending[i] = expiry_time
+        self.schedule(expiry_time, EventScheduler.EXPIRY, i)
+
+
+    def _schedule_recalc(self, i):
+        router = self.r[i]
+        if not router.fib_stale or i in self.recalc_pending:
+            return
+        self.recalc_pending.add(i)
+        self.schedule(max(self.now, router.recalc_time()), EventScheduler.RECALC, i)
+
+
+    def _schedule_flow(self, k, after):
+        idle = self.traffic.idle_ticks(self.traffic.flows[k])
+        if idle is not None:
+            self.schedule(after + idle * self.tick_interval, EventScheduler.FLOW, k)
+
+
+    def _expiry(self, i):
+        del self.expiry_pending[i]
+        self.r[i].expire_route_entries()
+        self._schedule_expiry(i)
+        self._schedule_recalc(i)
+
+
+    def _recalc(self, i):
+        self.recalc_pending.discard(i)
+        self.r[i].recalc_if_stale()
+        # recalculated on transmit in the meantime and stale again
+        self._schedule_recalc(i)
+
+
+    def _route_tx(self, i):
+        router = self.r[i]
+        router.tx_timer()
+        router.transmitted_now = True
+        self.transmitted.append(router)
+        for terminal in router.terminals.values():
+            for other in terminal.neighbors():
+                self._schedule_expiry(other.id)
+                self._schedule_recalc(other.id)
+        self.schedule(router._next_tx_time, EventScheduler.ROUTE_TX, i)
+
+
+    def _mobility(self):
+        if self.mobility_update(self.now):
+            self.schedule(self.now + self.mobility_interval, EventScheduler.MOBILITY)
+
+
+    def _flow(self, k):
+        self.traffic.send(self.traffic.flows[k], self.now)
+        self._schedule_flow(k, self.now + self.tick_interval)
+
+
+    def _tick(self):
+        self.tick(self.now)
+        # the transmit flags are drawn by the frame of this tick
+        for router in self.transmitted:
+            router.transmitted_now = False
+        self.transmitted = list()
+        self.schedule(self.now + self.tick_interval, EventScheduler.TICK)
+
+
+    def run(self, until):
+        for i, router in self.r.items():
+            self.schedule(router._next_tx_time, EventScheduler.ROUTE_TX, i)
+        self.schedule(self.mobility_interval, EventScheduler.MOBILITY)
+        for k in range(len(self.traffic.flows)):
+            self._schedule_flow(k, self.tick_interval)
+        self.schedule(self.tick_interval, EventScheduler.TICK)
+        while self.queue and self.queue[0][0] <= until:
+            self.now, _, _, kind, _, i = heapq.heappop(self.queue)
+            self.events_processed += 1
+            if kind == EventScheduler.EXPIRY or kind == EventScheduler.ROUTE_TX:
+                self.in_turn = i
+            else:
+                self.in_turn = math.inf
+            if kind == EventScheduler.EXPIRY:
+                self._expiry(i)
+            elif kind == EventScheduler.ROUTE_TX:
+                self._route_tx(i)
+            elif kind == EventScheduler.MOBILITY:
+                self._mobility()
+            elif kind == EventScheduler.RECALC:
+                self._recalc(i)
+            elif kind == EventScheduler.FLOW:
+                self._flow(i)
+            else:
+                self._tick()
+        self.in_turn = math.inf
+
+
+def frame_snapshot(r):
+    """Compact state of one tick, all the drawing functions need. It does
+    not reference the routers, thus it can be rendered later and in
+    another process. Routers are (id, x, y, prefix, transmitted now,
+    connected router indices per interface)."""
+    routers = list()
     for i in range(NO_ROUTER):
         router = r[i]
-        x = router.pos_x
-        y = router.pos_y
-
-        color = ((1.0, 1.0, 0.5, 0.05), (1.0, 0.0, 1.0, 0.05))
-        ctx.set_line_width(0.1)
-        path_thinkness = 4.0
-        # iterate over links
-        for i, t in enumerate(router.ti):
-            range_ = t['range']
-            path_type = t['path_type']
-            ctx.set_source_rgba(*color[i])
+        connections = tuple(tuple(router.terminals[t['path_type']].order) for t in router.ti)
+        routers.append((router.id, router.pos_x, router.pos_y, router.prefix_v4,
+                        router.transmitted_now, connections))
+    return {'area': (SIMU_AREA_X, SIMU_AREA_Y),
+            'ranges': tuple(t['range'] for t in INTERFACES),
+            'routers': routers}
+
+
+def draw_range_discs(snapshot, ctx, indices):
+    color = ((1.0, 1.0, 0.5, 0.05), (1.0, 0.0, 1.0, 0.05))
+    routers = snapshot['routers']
+    for idx in indices:
+        x, y = routers[idx][1], routers[idx][2]
+        for i, range_ in enumerate(snapshot['ranges']):
+            ctx.set_source_rgba(*color[i % len(color)])
             ctx.move_to(x, y)
             ctx.arc(x, y, range_, 0, 2 * math.pi)
             ctx.fill()
 
-            # draw lines between links
+
+def draw_links(snapshot, ctx):
+    # per interface, in the order of the interface table
+    c_links = ((1.0, 0.15, 0.15, 1.0), (0.15, 1.0, 0.15, 1.0), (0.15, 0.15, 1.0, 1.0), (1.0, 1.0, 0.15, 1.0))
+    routers = snapshot['routers']
+    for _, x, y, _, _, connections in routers:
+        path_thinkness = 4.0
+        for i in range(len(snapshot['ranges'])):
             ctx.set_line_width(path_thinkness)
-            for r_id, other in router.terminals[t['path_type']].connections.items():
-                other_x, other_y = other.pos_x, other.pos_y
+            for r_id in connections[i]:
+                other_x, other_y = routers[r_id][1], routers[r_id][2]
                 ctx.move_to(x, y)
-                ctx.set_source_rgba(*c_links[path_type])
+                ctx.set_source_rgba(*c_links[i % len(c_links)])
                 ctx.line_to(other_x, other_y)
                 ctx.stroke()
             path_thinkness -= 2.0
 
-    for i in range(NO_ROUTER):
-        router = r[i]
-        x = router.pos_x
-        y = router.pos_y
 
+def draw_router_labels(snapshot, ctx, indices):
+    routers = snapshot['routers']
+    for idx in indices:
+        router_id, x, y, prefix_v4, _, _ = routers[idx]
         # node middle point
         ctx.set_line_width(0.0)
         ctx.set_source_rgb(0.5, 1, 0.5)
@@ -798,54 +1992,61 @@ def draw_router_loc(r, path, img_idx):
         ctx.set_font_size(10)
         ctx.set_source_rgb(0.5, 1, 0.7)
         ctx.move_to(x + 10, y + 10)
-        ctx.show_text(str(router.id))
+        ctx.show_text(str(router_id))
 
         # router IP prefix
         ctx.set_font_size(8)
         ctx.set_source_rgba(0.5, 1, 0.7, 0.5)
         ctx.move_to(x + 10, y + 20)
-        ctx.show_text(router.prefix_v4)
+        ctx.show_text(prefix_v4)
 
-    full_path = os.path.join(path, "{0:05}.png".format(img_idx))
-    surface.write_to_png(full_path)
 
+def draw_router_loc(snapshot, ctx, layers=None):
+    """range discs, links and labels. layers are pre-drawn discs and
+    labels of some routers, (disc surface, label surface, indices)"""
+    area_x, area_y = snapshot['area']
+    ctx.rectangle(0, 0, area_x, area_y)
+    ctx.set_source_rgba(0.15, 0.15, 0.15, 1.0)
+    ctx.fill()
 
-def draw_router_transmission(r, path, img_idx):
-    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, SIMU_AREA_X, SIMU_AREA_Y)
-    ctx = cairo.Context(surface)
-    ctx.rectangle(0, 0, SIMU_AREA_X, SIMU_AREA_Y)
+    indices = range(len(snapshot['routers']))
+    if layers is not None:
+        discs, labels, cached = layers
+        indices = [idx for idx in indices if idx not in cached]
+        ctx.set_source_surface(discs, 0, 0)
+        ctx.paint()
+    draw_range_discs(snapshot, ctx, indices)
+    draw_links(snapshot, ctx)
+    if layers is not None:
+        ctx.set_source_surface(labels, 0, 0)
+        ctx.paint()
+    draw_router_labels(snapshot, ctx, indices)
+
+
+def draw_router_transmission(snapshot, ctx):
+    area_x, area_y = snapshot['area']
+    routers = snapshot['routers']
+    ctx.rectangle(0, 0, area_x, area_y)
     ctx.set_source_rgba(0.15, 0.15, 0.15, 1.0)
     ctx.fill()
 
     # transmitting circles
-    for i in range(NO_ROUTER):
-        router = r[i]
-        x = router.pos_x
-        y = router.pos_y
-
-        if router.transmitted_now:
+    for _, x, y, _, transmitted_now, _ in routers:
+        if transmitted_now:
             ctx.set_source_rgba(.10, .10, .10, 1.0)
             ctx.move_to(x, y)
             ctx.arc(x, y, 50, 0, 2 * math.pi)
             ctx.fill()
 
-    for i in range(NO_ROUTER):
-        router = r[i]
-        x = router.pos_x
-        y = router.pos_y
-
-        color = ((1.0, 1.0, 0.5, 0.05), (1.0, 0.0, 1.0, 0.05))
+    for _, x, y, _, _, connections in routers:
         ctx.set_line_width(0.1)
         path_thinkness = 6.0
         # iterate over links
-        for i, t in enumerate(router.ti):
-            range_ = t['range']
-            path_type = t['path_type']
-
+        for i in range(len(snapshot['ranges'])):
             # draw lines between links
             ctx.set_line_width(path_thinkness)
-            for r_id, other in router.terminals[t['path_type']].connections.items():
-                other_x, other_y = other.pos_x, other.pos_y
+            for r_id in connections[i]:
+                other_x, other_y = routers[r_id][1], routers[r_id][2]
                 ctx.move_to(x, y)
                 ctx.set_source_rgba(.0, .0, .0, .4)
                 ctx.line_to(other_x, other_y)
@@ -856,60 +2057,406 @@ def draw_router_transmission(r, path, img_idx):
                 path_thinkness = 2.0
 
     # draw dots over all
-    for i in range(NO_ROUTER):
-        router = r[i]
-        x = router.pos_x
-        y = router.pos_y
-
+    for _, x, y, _, _, _ in routers:
         ctx.set_line_width(0.0)
         ctx.set_source_rgb(0, 0, 0)
         ctx.move_to(x, y)
         ctx.arc(x, y, 5, 0, 2 * math.pi)
         ctx.fill()
 
-    full_path = os.path.join(path, "{0:05}.png".format(img_idx))
-    surface.write_to_png(full_path)
+
+class FrameComposer:
+    """Draws both panels side by side into one in-memory frame, the
+    surface is reused for every frame. Range discs and labels of routers
+    which did not move since the last frame are drawn once into cached
+    layers and blitted, until the set of stationary routers changes."""
+
+    def __init__(self):
+        self.surface = cairo.ImageSurface(cairo.FORMAT_RGB24, FRAME_WIDTH, FRAME_HEIGHT)
+        self.last_positions = None
+        self.layers = None
+        self.layers_key = None
+
+
+    def _static_layers(self, snapshot):
+        routers = snapshot['routers']
+        positions = [(x, y) for _, x, y, _, _, _ in routers]
+        last_positions, self.last_positions = self.last_positions, positions
+        if last_positions is None or len(last_positions) != len(positions):
+            return None
+        cached = [idx for idx in range(len(positions)) if positions[idx] == last_positions[idx]]
+        if len(cached) == 0:
+            return None
+        # everything the layers depend on
+        key = (snapshot['area'], snapshot['ranges'], tuple(routers[idx][:4] for idx in cached))
+        if key != self.layers_key:
+            area_x, area_y = snapshot['area']
+            discs = cairo.ImageSurface(cairo.FORMAT_ARGB32, area_x, area_y)
+            draw_range_discs(snapshot, cairo.Context(discs), cached)
+            labels = cairo.ImageSurface(cairo.FORMAT_ARGB32, area_x, area_y)
+            draw_router_labels(snapshot, cairo.Context(labels), cached)
+            self.layers = (discs, labels, frozenset(cached))
+            self.layers_key = key
+        return self.layers
+
+
+    def compose(self, snapshot):
+        area_x, area_y = snapshot['area']
+        layers = self._static_layers(snapshot)
+        ctx = cairo.Context(self.surface)
+        ctx.set_source_rgb(0, 0, 0)
+        ctx.paint()
+        for offset, draw in ((0, functools.partial(draw_router_loc, layers=layers)),
+                             (area_x, draw_router_transmission)):
+            ctx.save()
+            ctx.translate(offset, 0)
+            ctx.rectangle(0, 0, area_x, area_y)
+            ctx.clip()
+            draw(snapshot, ctx)
+            ctx.restore()
+        self.surface.flush()
+        return self.surface
+
+
+class VideoWriter:
+    """Pipes raw frames into the stdin of an ffmpeg process"""
+
+    def __init__(self, path, framerate):
+        if shutil.which("ffmpeg") is None:
+            raise Exception("ffmpeg not found, required for video output")
+        # RGB24 surfaces are native endian 32 bit words, 0xXXRRGGBB
+        pix_fmt = "bgr0" if sys.byteorder == "little" else "0rgb"
+        cmd = ["ffmpeg", "-loglevel", "error", "-y",
+               "-f", "rawvideo", "-pix_fmt", pix_fmt,
+               "-s", "{}x{}".format(FRAME_WIDTH, FRAME_HEIGHT),
+               "-framerate", str(framerate), "-i", "-",
+               "-c:v", "libx264", "-pix_fmt", "yuv420p", path]
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+
+    def write(self, frame):
+        self.process.stdin.write(frame)
+
+
+    def close(self):
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise Exception("ffmpeg failed with exit code {}".format(self.process.returncode))
+
+
+def frame_png_path(img_idx):
+    return os.path.join(PATH_IMAGES_MERGE, "{0:05}.png".format(img_idx))
+
+
+class FrameRenderer:
+    """--render video streams the frames to ffmpeg, --render png writes
+    them into PATH_IMAGES_MERGE for debugging. Frames are drawn in the
+    simulation loop, see AsyncFrameRenderer for rendering in parallel.
+    Only every Nth tick is rendered and, with changes_only, only if
+    positions, links or transmissions differ from the last frame."""
+
+    def __init__(self, mode, video_path, framerate, every=1, changes_only=False):
+        self.video = None
+        if mode == "video":
+            self.video = VideoWriter(video_path, framerate)
+        else:
+            setup_img_folder()
+        self.every = every
+        self.changes_only = changes_only
+        self.last_snapshot = None
+        self.composer = None
+
+
+    def frame(self, r, img_idx):
+        if img_idx % self.every != 0:
+            return
+        snapshot = frame_snapshot(r)
+        if self.changes_only and snapshot == self.last_snapshot:
+            return
+        self.last_snapshot = snapshot
+        self._render(snapshot, img_idx)
 
 
-def image_merge(merge_path, range_path, tx_path, img_idx):
+    def _render(self, snapshot, img_idx):
+        if self.composer is None:
+            self.composer = FrameComposer()
+        surface = self.composer.compose(snapshot)
+        if self.video is not None:
+            self.video.write(surface.get_data())
+        else:
+            surface.write_to_png(frame_png_path(img_idx))
 
-    m_path = os.path.join(merge_path, "{0:05}.png".format(img_idx))
-    r_path = os.path.join(range_path, "{0:05}.png".format(img_idx))
-    t_path = os.path.join(tx_path,    "{0:05}.png".format(img_idx))
 
-    images = map(Image.open, [r_path, t_path])
-    new_im = Image.new('RGB', (1920, 1080))
+    def close(self):
+        if self.video is not None:
+            self.video.close()
 
-    x_offset = 0
-    for im in images:
-        new_im.paste(im, (x_offset,0))
-        x_offset += im.size[0]
 
-    new_im.save(m_path, "PNG")
+_RENDER_COMPOSER = None
 
 
-def draw_images(r, img_idx):
-    draw_router_loc(r, PATH_IMAGES_RANGE, img_idx)
-    draw_router_transmission(r, PATH_IMAGES_TX, img_idx)
+def _render_worker(snapshot, png_path):
+    """draws one frame in a render process, returns the raw frame or
+    writes the PNG file if png_path is given"""
+    global _RENDER_COMPOSER
+    if _RENDER_COMPOSER is None:
+        _RENDER_COMPOSER = FrameComposer()
+    surface = _RENDER_COMPOSER.compose(snapshot)
+    if png_path is not None:
+        surface.write_to_png(png_path)
+        return None
+    return bytes(surface.get_data())
 
-    image_merge(PATH_IMAGES_MERGE, PATH_IMAGES_RANGE, PATH_IMAGES_TX, img_idx)
 
+class AsyncFrameRenderer(FrameRenderer):
+    """The simulation only takes a snapshot per tick, render processes
+    draw the frames meanwhile. At most queue_size frames are in flight,
+    the simulation waits for the oldest one if the queue is full. Frames
+    are written in the order of the ticks."""
+
+    def __init__(self, mode, video_path, framerate, jobs, queue_size, every=1, changes_only=False):
+        super().__init__(mode, video_path, framerate, every, changes_only)
+        # the ffmpeg pipe and the open log files are not inherited by
+        # spawned processes
+        context = multiprocessing.get_context("spawn")
+        self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=jobs, mp_context=context)
+        self.queue_size = queue_size
+        self.pending = collections.deque()
+
+
+    def _write_oldest(self):
+        frame = self.pending.popleft().result()
+        if self.video is not None:
+            self.video.write(frame)
 
-def setup_img_folder():
-    for path in (PATH_IMAGES_RANGE, PATH_IMAGES_TX, PATH_IMAGES_MERGE):
-        if os.path.exists(path):
-            shutil.rmtree(path)
-        os.makedirs(path)
 
+    def _render(self, snapshot, img_idx):
+        while len(self.pending) >= self.queue_size:
+            self._write_oldest()
+        png_path = None if self.video is not None else frame_png_path(img_idx)
+        self.pending.append(self.pool.submit(_render_worker, snapshot, png_path))
 
-def gen_data_packet(src_id, dst_id, tos='low-loss'):
-    packet = addict.Dict()
-    packet.src_id = src_id
-    packet.dst_id = dst_id
-    packet.ttl = DEFAULT_PACKET_TTL
-    # the prefered transmit is via wifi00, can be tetra if not possible
-    packet.tos = tos
-    return packet
+
+    def close(self):
+        try:
+            while self.pending:
+                self._write_oldest()
+        finally:
+            self.pool.shutdown()
+            super().close()
+
+
+def setup_img_folder():
+    if os.path.exists(PATH_IMAGES_MERGE):
+        shutil.rmtree(PATH_IMAGES_MERGE)
+    os.makedirs(PATH_IMAGES_MERGE)
+
+
+class Flow:
+    """One traffic flow and its counters. kind is 'cbr', rate packets
+    every second, or 'poisson' with a mean of rate packets per second."""
+
+    def __init__(self, flow_id, src, dst, tos, kind='cbr', rate=1.0):
+        self.id = flow_id
+        self.src = src
+        self.dst = dst
+        self.tos = tos
+        self.kind = kind
+        self.rate = rate
+        self.credit = 0.0
+        self.sent = 0
+        self.delivered = 0
+        self.dropped = collections.Counter()
+        # sums over the delivered packets
+        self.hops = 0
+        self.stretch = 0.0
+        self.stretch_packets = 0
+
+
+    def statistics(self):
+        delivered = self.delivered or 1
+        return {"flow": self.id, "src": self.src, "dst": self.dst, "tos": self.tos,
+                "sent": self.sent, "delivered": self.delivered,
+                "delivery-ratio": round(self.delivered / self.sent, 4) if self.sent else 0.0,
+                "hops": round(self.hops / delivered, 2),
+                "stretch": round(self.stretch / self.stretch_packets, 3) if self.stretch_packets else 0.0,
+                "no-route": self.dropped['no-route'], "unreachable": self.dropped['unreachable'],
+                "ttl": self.dropped['ttl'], "loops": self.dropped['loop']}
+
+
+class PathCache:
+    """LRU cache of forwarding results per (src, dst, tos). An entry is
+    (result, hops, path), it is valid as long as every router on the path
+    has the same FIB version and every link of the path still exists."""
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        for router, fib_version, interface, next_hop_addr in entry[2]:
+            if router.fib_version != fib_version or \
+               (next_hop_addr is not None and next_hop_addr not in router.terminals[interface]):
+                del self.entries[key]
+                self.invalidations += 1
+                self.misses += 1
+                return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+
+class TrafficEngine:
+    """Generates the packets of all flows once per tick. Packets of a flow
+    sent in the same tick share the path, thus they are forwarded as one
+    batch. The engine has its own random generator, traffic does not
+    change the random sequence of the routing simulation."""
+
+    def __init__(self, r, flows, seed, cache_size=0):
+        self.r = r
+        self.flows = flows
+        self.random = random.Random(seed)
+        self._optimum = dict()
+        self._optimum_time = None
+        self.cache = PathCache(cache_size) if cache_size > 0 else None
+
+
+    def _packets(self, flow):
+        if flow.kind == 'poisson':
+            count = 0
+            arrival = self.random.expovariate(flow.rate)
+            while arrival < 1.0:
+                count += 1
+                arrival += self.random.expovariate(flow.rate)
+            return count
+        flow.credit += flow.rate
+        count = int(flow.credit)
+        flow.credit -= count
+        return count
+
+
+    def _optimal_hops(self, src, dst):
+        # breadth first search over the links of all interfaces, once
+        # per source and tick
+        dist = self._optimum.get(src)
+        if dist is None:
+            start = self.r[src]
+            dist = self._optimum[src] = {start.id: 0}
+            queue = collections.deque([start])
+            while queue:
+                router = queue.popleft()
+                for terminal in router.terminals.values():
+                    for other in terminal.neighbors():
+                        if other.id not in dist:
+                            dist[other.id] = dist[router.id] + 1
+                            queue.append(other)
+        return dist.get(dst)
+
+
+    def _forward(self, flow, count):
+        src = self.r[flow.src]
+        if self.cache is None:
+            return src.forward_data_packet(flow.dst, flow.tos, count)
+        key = (flow.src, flow.dst, flow.tos)
+        entry = self.cache.get(key)
+        if entry is not None:
+            return src.forward_cached(flow.dst, entry, count)
+        path = list()
+        result, hops = src.forward_data_packet(flow.dst, flow.tos, count, path=path)
+        # a missing link is a transient state, the route is not yet expired
+        if result != 'unreachable':
+            self.cache.put(key, (result, hops, path))
+        return result, hops
+
+
+    def idle_ticks(self, flow):
+        """number of ticks before the next one in which flow sends, the
+        credit of a cbr flow is advanced over them as if they were
+        ticked. Poisson flows draw random numbers in every tick, thus
+        they are never idle. None if the flow never sends again."""
+        if flow.kind == 'poisson':
+            return 0
+        if flow.rate <= 0:
+            return None
+        idle = 0
+        while int(flow.credit + flow.rate) == 0:
+            flow.credit += flow.rate
+            idle += 1
+        return idle
+
+
+    def tick(self, now):
+        for flow in self.flows:
+            self.send(flow, now)
+
+
+    def send(self, flow, now):
+        """packets of flow in the tick at time now"""
+        if now != self._optimum_time:
+            self._optimum = dict()
+            self._optimum_time = now
+        count = self._packets(flow)
+        if count == 0:
+            return
+        flow.sent += count
+        result, hops = self._forward(flow, count)
+        if result != 'delivered':
+            flow.dropped[result] += count
+            return
+        flow.delivered += count
+        flow.hops += hops * count
+        optimum = self._optimal_hops(flow.src, flow.dst)
+        if optimum:
+            flow.stretch += hops / optimum * count
+            flow.stretch_packets += count
+
+
+    def statistics(self):
+        return [flow.statistics() for flow in self.flows]
+
+
+def setup_flows(args, src_id, dst_id, rnd):
+    """flows of the --flows file and --random-flows pairs, the single
+    src_id -> dst_id pair if neither is given. Pairs without a TOS get a
+    flow per TOS class."""
+    pairs = list()
+    if args.flows:
+        with open(args.flows) as fd:
+            for entry in json.load(fd):
+                tos_list = [entry['tos']] if 'tos' in entry else ['low_loss', 'high_bandwidth']
+                for tos in tos_list:
+                    pairs.append((entry['src'], entry['dst'], tos,
+                                  entry.get('type', args.flow_type), entry.get('rate', args.flow_rate)))
+    for _ in range(args.random_flows):
+        src, dst = rnd.sample(range(NO_ROUTER), 2)
+        for tos in ('low_loss', 'high_bandwidth'):
+            pairs.append((src, dst, tos, args.flow_type, args.flow_rate))
+    if len(pairs) == 0:
+        for tos in ('low_loss', 'high_bandwidth'):
+            pairs.append((src_id, dst_id, tos, args.flow_type, args.flow_rate))
+    return [Flow(i, *pair) for i, pair in enumerate(pairs)]
+
+
+def setup_output_folder(path):
+    global PATH_LOGS, PATH_IMAGES_MERGE
+    PATH_LOGS = os.path.join(path, "logs")
+    PATH_IMAGES_MERGE = os.path.join(path, "images-merge")
 
 
 def setup_log_folder():
@@ -918,40 +2465,546 @@ def setup_log_folder():
     os.makedirs(PATH_LOGS)
 
 
-def main():
-    #setup_img_folder()
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="MDVRD routing protocol simulator")
+    parser.add_argument("--routers", type=int, default=NO_ROUTER, help="number of routers")
+    parser.add_argument("--area", type=int, nargs=2, default=(SIMU_AREA_X, SIMU_AREA_Y), metavar=("X", "Y"),
+                        help="size of the simulation area")
+    parser.add_argument("--time", type=int, default=SIMULATION_TIME_SEC, metavar="SEC",
+                        help="simulated time")
+    parser.add_argument("--tx-interval", type=int, default=TX_INTERVAL, metavar="SEC",
+                        help="route packet transmit interval, jitter and dead interval are derived")
+    parser.add_argument("--interfaces", metavar="FILE",
+                        help="JSON file with the interface table (path_type, range, bandwidth, loss)")
+    parser.add_argument("--seed", type=int, default=SEED, help="random seed")
+    parser.add_argument("--output-dir", default=".", metavar="DIR",
+                        help="directory for logs and images")
+    parser.add_argument("--sweep", metavar="FILE",
+                        help="run the parameter grid of a JSON sweep file in a process pool, see run_sweep()")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(),
+                        help="number of worker processes of a sweep")
+    parser.add_argument("--numpy", action="store_true",
+                        help="move routers and calculate distances vectorized with NumPy")
+    parser.add_argument("--event-driven", action="store_true",
+                        help="use the discrete event scheduler instead of polling every router every second")
+    parser.add_argument("--coalesce-recalc", action="store_true",
+                        help="recalculate routing tables once per tick instead of for every received packet")
+    parser.add_argument("--recalc-holddown", type=int, default=0, metavar="SEC",
+                        help="delay stale routing table recalculations by SEC seconds, implies --coalesce-recalc")
+    parser.add_argument("--parallel-recalc", type=int, default=0, metavar="JOBS",
+                        help="recalculate stale routing tables at the end of a tick in JOBS worker processes, "
+                             "implies --coalesce-recalc")
+    parser.add_argument("--log-level", choices=sorted(LOG_LEVELS), default="debug",
+                        help="router log level, routing tables are logged at debug level")
+    parser.add_argument("--log-shard", action="store_true",
+                        help="split the shared log file into per router files at the end")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="record a binary event trace, see mdvrd-trace.py")
+    parser.add_argument("--summary-json", metavar="FILE",
+                        help="write the summary of the run and the per flow statistics as JSON")
+    parser.add_argument("--flows", metavar="FILE",
+                        help="JSON list of flows: src, dst and optionally tos, type and rate")
+    parser.add_argument("--random-flows", type=int, default=0, metavar="N",
+                        help="add N random source/destination pairs, each with a flow per TOS class")
+    parser.add_argument("--flow-type", choices=("cbr", "poisson"), default="cbr",
+                        help="constant bit rate or Poisson arrivals")
+    parser.add_argument("--flow-rate", type=float, default=1.0, metavar="PACKETS",
+                        help="packets per second and flow")
+    parser.add_argument("--traffic-seed", type=int, metavar="SEED",
+                        help="random seed of the traffic generators, --seed by default")
+    parser.add_argument("--path-cache", type=int, default=0, metavar="ENTRIES",
+                        help="cache forwarding paths per source, destination and TOS until a FIB on the "
+                             "path changes, cache hits are not logged per hop")
+    parser.add_argument("--instrument", action="store_true",
+                        help="time the simulation phases and count hot path events")
+    parser.add_argument("--instrument-interval", type=int, default=60, metavar="SEC",
+                        help="print the instrumentation table every SEC simulated seconds, 0 only at the end")
+    parser.add_argument("--instrument-json", metavar="FILE",
+                        help="final instrumentation dump, instrumentation.json in the output directory by default")
+    parser.add_argument("--render", choices=("video", "png"),
+                        help="render a frame per simulated second, either piped into ffmpeg "
+                             "or as PNG files for debugging")
+    parser.add_argument("--video", default="mdvrd.mp4", metavar="FILE",
+                        help="video file of --render video, relative to the output directory")
+    parser.add_argument("--framerate", type=int, default=10,
+                        help="frames per second of the video")
+    parser.add_argument("--render-jobs", type=int, default=0, metavar="JOBS",
+                        help="render frames in JOBS worker processes while the simulation continues, "
+                             "0 renders in the simulation loop")
+    parser.add_argument("--render-queue", type=int, default=0, metavar="FRAMES",
+                        help="maximum number of frames in flight with --render-jobs, "
+                             "the default is twice the number of jobs")
+    parser.add_argument("--render-every", type=int, default=1, metavar="N",
+                        help="render only every Nth simulated second")
+    parser.add_argument("--render-changes", action="store_true",
+                        help="render a frame only if positions, links or transmissions changed")
+    parser.add_argument("--medium", action="store_true",
+                        help="queue route packets on a shared broadcast medium and deliver them in a batched "
+                             "receive phase after all routers transmitted, instead of within the transmit loop")
+    parser.add_argument("--propagation-delay", type=int, default=0, metavar="SEC",
+                        help="delay of route packets on the medium, implies --medium")
+    parser.add_argument("--medium-loss", action="store_true",
+                        help="drop route packets on the medium with the loss of the interface table in percent, "
+                             "random draws are vectorized with --numpy, implies --medium")
+    parser.add_argument("--checkpoint-at", type=int, nargs="+", default=[], metavar="SEC",
+                        help="write the simulation state after SEC simulated seconds into "
+                             "checkpoint-SEC.bin in the output directory")
+    parser.add_argument("--resume", metavar="FILE",
+                        help="continue the simulation of a checkpoint until --time. Routers, area, intervals, "
+                             "interfaces, flows and the medium are the ones of the checkpoint, --numpy must match")
+    args = parser.parse_args(argv)
+    if args.parallel_recalc and args.event_driven:
+        parser.error("--parallel-recalc works on the per tick loop, not with --event-driven")
+    if (args.checkpoint_at or args.resume) and args.event_driven:
+        parser.error("checkpoints work on the per tick loop, not with --event-driven")
+    if (args.medium or args.propagation_delay > 0 or args.medium_loss) and args.event_driven:
+        parser.error("the medium works on the per tick loop, not with --event-driven")
+    return args
+
+
+def configure(args):
+    global NO_ROUTER, SIMU_AREA_X, SIMU_AREA_Y, SIMULATION_TIME_SEC
+    global TX_INTERVAL, TX_INTERVAL_JITTER, DEAD_INTERVAL, INTERFACES
+    NO_ROUTER = args.routers
+    SIMU_AREA_X, SIMU_AREA_Y = args.area
+    SIMULATION_TIME_SEC = args.time
+    TX_INTERVAL = args.tx_interval
+    TX_INTERVAL_JITTER = int(TX_INTERVAL / 4)
+    DEAD_INTERVAL = TX_INTERVAL * 3 + 1
+    if args.interfaces:
+        with open(args.interfaces) as fd:
+            INTERFACES = json.load(fd)
+    global ROUTE_RECALC_COALESCE, ROUTE_RECALC_HOLDDOWN
+    ROUTE_RECALC_COALESCE = args.coalesce_recalc or args.recalc_holddown > 0 or args.parallel_recalc > 0
+    ROUTE_RECALC_HOLDDOWN = args.recalc_holddown
+    global LOG_LEVEL
+    LOG_LEVEL = LOG_LEVELS[args.log_level]
+    setup_output_folder(args.output_dir)
+    random.seed(args.seed)
+
+
+def reset_statistics():
+    global ROUTE_RECALC_REQUESTS, ROUTE_RECALC
+    global FIB_LAST_CHANGE, DATA_DELIVERED, DATA_DROPPED, DATA_LOOPS
+    ROUTE_RECALC_REQUESTS = 0
+    ROUTE_RECALC = 0
+    FIB_LAST_CHANGE = 0
+    DATA_DELIVERED = 0
+    DATA_DROPPED = 0
+    DATA_LOOPS = 0
+
+
+def summary():
+    cache = TRAFFIC.cache if TRAFFIC is not None else None
+    return {"routers": NO_ROUTER, "area-x": SIMU_AREA_X, "area-y": SIMU_AREA_Y,
+            "time": SIMULATION_TIME_SEC, "tx-interval": TX_INTERVAL,
+            "convergence-time": FIB_LAST_CHANGE,
+            "data-delivered": DATA_DELIVERED, "data-dropped": DATA_DROPPED, "data-loops": DATA_LOOPS,
+            "route-recalc": ROUTE_RECALC, "route-recalc-requests": ROUTE_RECALC_REQUESTS,
+            "path-cache-hits": cache.hits if cache else 0,
+            "path-cache-misses": cache.misses if cache else 0,
+            "medium-received": MEDIUM.received if MEDIUM else 0,
+            "medium-lost": MEDIUM.lost if MEDIUM else 0}
+
+
+def print_statistics():
+    saved = ROUTE_RECALC_REQUESTS - ROUTE_RECALC
+    msg = "route recalculations: {} (requested: {}, saved: {})"
+    print(msg.format(ROUTE_RECALC, ROUTE_RECALC_REQUESTS, saved))
+    if MEDIUM is not None:
+        print("medium: {} route packets received, {} lost".format(MEDIUM.received, MEDIUM.lost))
+    if TRAFFIC is not None and TRAFFIC.cache is not None:
+        cache = TRAFFIC.cache
+        msg = "path cache: {} hits, {} misses ({} invalidated, {} evicted)"
+        print(msg.format(cache.hits, cache.misses, cache.invalidations, cache.evictions))
+    if TRAFFIC is not None:
+        print_flow_statistics(TRAFFIC.statistics())
+
+
+def print_flow_statistics(stats):
+    columns = ("flow", "src", "dst", "tos", "sent", "delivered", "delivery-ratio",
+               "hops", "stretch", "no-route", "unreachable", "ttl", "loops")
+    print(" ".join("{:>14}".format(c) for c in columns))
+    for flow in stats:
+        print(" ".join("{:>14}".format(flow[c]) for c in columns))
+
+
+def peak_rss():
+    """peak resident set size of the process in kB, None if unknown"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kB elsewhere
+    if sys.platform == "darwin":
+        rss //= 1024
+    return rss
+
+
+def instrumentation_tick(args, sec, r):
+    if INSTR is not None and args.instrument_interval > 0 and sec % args.instrument_interval == 0:
+        INSTR.print_table(sec, r)
+
+
+class _CheckpointUnpickler(pickle.Unpickler):
+
+    def find_class(self, module, name):
+        try:
+            return super().find_class(module, name)
+        except (ImportError, AttributeError):
+            # written by the simulator loaded under another module name,
+            # e.g. run as script (__main__) versus loaded by mdvrd-bench.py
+            obj = globals()[name.split(".")[0]]
+            for attr in name.split(".")[1:]:
+                obj = getattr(obj, attr)
+            return obj
+
+
+def write_checkpoint(path, sec, r, mobility):
+    """Writes the state after sec simulated seconds: the scenario, all
+    routers (positions, mobility, received routing data, FIBs, sequence
+    numbers, timers), the mobility engine, the traffic engine with its
+    flows and random generator, the medium with its queued packets, the
+    statistics and the global random state. Magic "MDVRDCK1" followed
+    by a zlib compressed pickle, FIB snapshots shared by several routers
+    are stored once."""
+    state = {"time": sec,
+             "config": {"routers": NO_ROUTER, "area": (SIMU_AREA_X, SIMU_AREA_Y),
+                        "tx-interval": TX_INTERVAL, "tx-interval-jitter": TX_INTERVAL_JITTER,
+                        "dead-interval": DEAD_INTERVAL, "interfaces": INTERFACES},
+             "statistics": {"route-recalc-requests": ROUTE_RECALC_REQUESTS, "route-recalc": ROUTE_RECALC,
+                            "fib-last-change": FIB_LAST_CHANGE, "data-delivered": DATA_DELIVERED,
+                            "data-dropped": DATA_DROPPED, "data-loops": DATA_LOOPS},
+             "random": random.getstate(),
+             "routers": r,
+             "mobility": mobility,
+             "traffic": TRAFFIC,
+             "medium": MEDIUM}
+    data = zlib.compress(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))
+    with open(path, 'wb') as fd:
+        fd.write(CHECKPOINT_MAGIC)
+        fd.write(data)
+    print("checkpoint after {} s written to {} ({} kB)".format(sec, path, len(data) // 1024))
+
+
+def read_checkpoint(path):
+    with open(path, 'rb') as fd:
+        data = fd.read()
+    if data[:len(CHECKPOINT_MAGIC)] != CHECKPOINT_MAGIC:
+        raise Exception("{} is not a checkpoint file".format(path))
+    data = zlib.decompress(data[len(CHECKPOINT_MAGIC):])
+    return _CheckpointUnpickler(io.BytesIO(data)).load()
+
+
+def restore_checkpoint(state):
+    """takes over the scenario, statistics, traffic, medium and random state
+    of a checkpoint, the routers and the mobility engine are used as they
+    are"""
+    global NO_ROUTER, SIMU_AREA_X, SIMU_AREA_Y
+    global TX_INTERVAL, TX_INTERVAL_JITTER, DEAD_INTERVAL, INTERFACES
+    config = state["config"]
+    NO_ROUTER = config["routers"]
+    SIMU_AREA_X, SIMU_AREA_Y = config["area"]
+    TX_INTERVAL = config["tx-interval"]
+    TX_INTERVAL_JITTER = config["tx-interval-jitter"]
+    DEAD_INTERVAL = config["dead-interval"]
+    INTERFACES = config["interfaces"]
+    global ROUTE_RECALC_REQUESTS, ROUTE_RECALC
+    global FIB_LAST_CHANGE, DATA_DELIVERED, DATA_DROPPED, DATA_LOOPS
+    stats = state["statistics"]
+    ROUTE_RECALC_REQUESTS = stats["route-recalc-requests"]
+    ROUTE_RECALC = stats["route-recalc"]
+    FIB_LAST_CHANGE = stats["fib-last-change"]
+    DATA_DELIVERED = stats["data-delivered"]
+    DATA_DROPPED = stats["data-dropped"]
+    DATA_LOOPS = stats["data-loops"]
+    global TRAFFIC, MEDIUM
+    TRAFFIC = state["traffic"]
+    MEDIUM = state.get("medium")
+    random.setstate(state["random"])
+
+
+def simulate(args):
+    """runs one simulation, returns the summary of it"""
+    global LOG_SINK, TRACE, INSTR, CLOCK
+    # sweep workers run one simulation after the other, a failed run
+    # must not leave its log, trace or instrumentation to the next one
+    LOG_SINK = TRACE = INSTR = CLOCK = None
+    try:
+        return _simulate(args)
+    finally:
+        CLOCK = None
+        if INSTR is not None:
+            INSTR.uninstall()
+            INSTR = None
+        if TRACE is not None:
+            TRACE.close()
+            TRACE = None
+        if LOG_SINK is not None:
+            LOG_SINK.close()
+            LOG_SINK = None
+
+
+def _simulate(args):
+    configure(args)
+    reset_statistics()
+    wall_start = time.time()
+    global LOG_SINK
     setup_log_folder()
+    if LOG_LEVEL < LOG_OFF:
+        LOG_SINK = LogSink(os.path.join(PATH_LOGS, LOG_FILE))
+    global TRACE
+    if args.trace:
+        TRACE = TraceWriter(args.trace)
+    global INSTR
+    if args.instrument:
+        INSTR = Instrumentation()
+        INSTR.install()
+
+    renderer = None
+    if args.render:
+        video_path = os.path.join(args.output_dir, args.video)
+        if args.render_jobs > 0:
+            queue_size = args.render_queue or 2 * args.render_jobs
+            renderer = AsyncFrameRenderer(args.render, video_path, args.framerate,
+                                          args.render_jobs, queue_size,
+                                          args.render_every, args.render_changes)
+        else:
+            renderer = FrameRenderer(args.render, video_path, args.framerate,
+                                     args.render_every, args.render_changes)
+
+    try:
+        global MEDIUM
+        MEDIUM = None
+        start = 0
+        if args.resume:
+            state = read_checkpoint(args.resume)
+            if args.numpy != isinstance(state["mobility"], VectorizedMobility):
+                raise Exception("--numpy must match the run which wrote {}".format(args.resume))
+            restore_checkpoint(state)
+            start = state["time"]
+            r = state["routers"]
+            mobility = state["mobility"]
+            if args.numpy:
+                engine = mobility
+            else:
+                index = mobility
+            del state
+        else:
+            ti = INTERFACES
 
-    ti = [ {"path_type": "2", "range" : 50, "bandwidth" : 10000, "loss" : 20},
-           {"path_type": "1", "range" : 200, "bandwidth" : 1000, "loss" : 5 },
-           {"path_type": "4", "range" : 100, "bandwidth" : 30000, "loss" : 30},
-           {"path_type": "3", "range" : 300, "bandwidth" : 2000, "loss" : 10 }  ]
+            r = dict()
+            for i in range(NO_ROUTER):
+                prefix_v4 = rand_ip_prefix('v4')
+                r[i] = Router(i, ti, prefix_v4, r)
 
-    r = dict()
-    for i in range(NO_ROUTER):
-        prefix_v4 = rand_ip_prefix('v4')
-        r[i] = Router(i, ti, prefix_v4)
-
-    # initial positioning
-    dist_update_all(r)
-
-    src_id = random.randint(0, NO_ROUTER - 1)
-    dst_id = random.randint(0, NO_ROUTER - 1)
-    packet_low_loss       = gen_data_packet(src_id, dst_id, tos='low_loss')
-    packet_high_througput = gen_data_packet(src_id, dst_id, tos='high_bandwidth')
-    for sec in range(SIMULATION_TIME_SEC):
-        sep = '=' * 50
-        print("\n{}\nsimulation time:{:6}/{}\n".format(sep, sec, SIMULATION_TIME_SEC))
-        for i in range(NO_ROUTER):
-            r[i].step()
-        dist_update_all(r)
-        #draw_images(r, sec)
-        # inject test data packet into network
-        r[src_id].forward_data_packet(packet_low_loss)
-        r[src_id].forward_data_packet(packet_high_througput)
-
-    cmd = "ffmpeg -framerate 10 -pattern_type glob -i 'images-merge/*.png' -c:v libx264 -pix_fmt yuv420p mdvrd.mp4"
-    print("now execute \"{}\" to generate a video".format(cmd))
+            # initial positioning
+            if args.numpy:
+                engine = mobility = VectorizedMobility(r)
+                engine.dist_update()
+            else:
+                index = mobility = SpatialIndex(r)
+                dist_update_all(r, index)
+
+            # drawn in any case to keep the random sequence of the simulation
+            src_id = random.randint(0, NO_ROUTER - 1)
+            dst_id = random.randint(0, NO_ROUTER - 1)
+            global TRAFFIC
+            traffic_seed = args.seed if args.traffic_seed is None else args.traffic_seed
+            traffic_random = random.Random(traffic_seed)
+            flows = setup_flows(args, src_id, dst_id, traffic_random)
+            TRAFFIC = TrafficEngine(r, flows, traffic_random.random(), args.path_cache)
+            if args.medium or args.propagation_delay > 0 or args.medium_loss:
+                MEDIUM = Medium(ti, args.seed, args.propagation_delay, args.medium_loss, args.numpy)
+
+        if args.event_driven:
+            if args.numpy:
+                mobile = list(r.values()) if engine.is_moving() else list()
+            else:
+                mobile = [router for router in r.values() if router.mm.is_moving()]
+
+            mobile_ids = [router.id for router in mobile]
+
+            def mobility_update(now):
+                # stationary topologies require no mobility events at all
+                if not mobile:
+                    return False
+                if args.numpy:
+                    engine.move()
+                    engine.dist_update()
+                else:
+                    for router in mobile:
+                        router.move()
+                    index.update(r, mobile_ids)
+                return True
+
+            def tick(now):
+                sep = '=' * 50
+                print("\n{}\nsimulation time:{:6}/{}\n".format(sep, now - 1, SIMULATION_TIME_SEC))
+                if renderer is not None:
+                    renderer.frame(r, now - 1)
+                instrumentation_tick(args, now, r)
+
+            global CLOCK
+            CLOCK = EventScheduler(r, mobility_update, tick, TRAFFIC)
+            CLOCK.run(SIMULATION_TIME_SEC)
+        else:
+            parallel = None
+            if args.parallel_recalc:
+                parallel = ParallelRecalc(args.parallel_recalc)
+            try:
+                for sec in range(start, SIMULATION_TIME_SEC):
+                    sep = '=' * 50
+                    print("\n{}\nsimulation time:{:6}/{}\n".format(sep, sec, SIMULATION_TIME_SEC))
+                    if args.numpy:
+                        engine.move()
+                    for i in range(NO_ROUTER):
+                        r[i].step()
+                    if MEDIUM is not None:
+                        MEDIUM.deliver(sec + 1)
+                    if args.numpy:
+                        engine.dist_update()
+                    else:
+                        dist_update_all(r, index)
+                    if parallel is not None:
+                        parallel.run([r[i] for i in range(NO_ROUTER)])
+                    else:
+                        for i in range(NO_ROUTER):
+                            r[i].recalc_if_stale()
+                    if renderer is not None:
+                        renderer.frame(r, sec)
+                    # data plane traffic
+                    TRAFFIC.tick(sec + 1)
+                    instrumentation_tick(args, sec + 1, r)
+                    if sec + 1 in args.checkpoint_at:
+                        path = os.path.join(args.output_dir, "checkpoint-{}.bin".format(sec + 1))
+                        write_checkpoint(path, sec + 1, r, mobility)
+            finally:
+                if parallel is not None:
+                    parallel.close()
+    finally:
+        if renderer is not None:
+            renderer.close()
+
+    if LOG_SINK is not None:
+        LOG_SINK.close()
+        if args.log_shard:
+            LOG_SINK.shard(PATH_LOGS)
+        LOG_SINK = None
+    if TRACE is not None:
+        TRACE.close()
+        TRACE = None
+    instr_report = None
+    if INSTR is not None:
+        INSTR.uninstall()
+        if args.instrument_interval == 0 or SIMULATION_TIME_SEC % args.instrument_interval != 0:
+            INSTR.print_table(SIMULATION_TIME_SEC, r)
+        instr_report = INSTR.report(r)
+        path = args.instrument_json or os.path.join(args.output_dir, "instrumentation.json")
+        with open(path, "w") as fd:
+            json.dump(instr_report, fd, indent=2)
+        INSTR = None
+    result = summary()
+    result["seed"] = args.seed
+    result["wall-time"] = round(time.time() - wall_start, 3)
+    result["peak-rss"] = peak_rss()
+    if instr_report is not None:
+        for phase, stats in instr_report["phases"].items():
+            result["phase-" + phase] = stats["total"]
+    return result
+
+
+def _sweep_run(run_dir, argv):
+    """worker of run_sweep(), stdout of the run goes into its directory"""
+    os.makedirs(run_dir, exist_ok=True)
+    args = parse_args(argv + ["--output-dir", run_dir])
+    with open(os.path.join(run_dir, "stdout.txt"), "w") as fd:
+        with contextlib.redirect_stdout(fd):
+            return simulate(args)
+
+
+def run_sweep(args):
+    """Runs every scenario of a parameter grid as independent simulation
+    in a process pool. The sweep file is JSON, all keys are optional:
+
+        {"routers": [50, 200], "area": [[10, 10], [960, 1080]],
+         "tx-interval": [30], "seeds": [1, 2, 3],
+         "interfaces": {"default": [...interface table...]},
+         "options": ["--log-level", "off"]}
+
+    Every run gets its own directory below --output-dir, the summaries of
+    all runs are merged into results.csv."""
+    with open(args.sweep) as fd:
+        grid = json.load(fd)
+    os.makedirs(args.output_dir, exist_ok=True)
+    interfaces = grid.get("interfaces", {"default": INTERFACES})
+    for name, table in interfaces.items():
+        with open(os.path.join(args.output_dir, "interfaces-{}.json".format(name)), "w") as fd:
+            json.dump(table, fd)
+
+    runs = list()
+    scenarios = itertools.product(grid.get("routers", [args.routers]),
+                                  grid.get("area", [args.area]),
+                                  grid.get("tx-interval", [args.tx_interval]),
+                                  sorted(interfaces),
+                                  grid.get("seeds", [args.seed]))
+    for routers, area, tx_interval, name, seed in scenarios:
+        run_name = "r{}-a{}x{}-tx{}-{}-s{}".format(routers, area[0], area[1], tx_interval, name, seed)
+        argv = ["--routers", str(routers), "--area", str(area[0]), str(area[1]),
+                "--tx-interval", str(tx_interval), "--seed", str(seed), "--time", str(args.time),
+                "--interfaces", os.path.join(args.output_dir, "interfaces-{}.json".format(name))]
+        argv += grid.get("options", [])
+        runs.append((run_name, name, argv))
+
+    results = list()
+    # a fresh worker process per run, the peak RSS of a reused worker
+    # would be the maximum of all its runs so far
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs, mp_context=context,
+                                                max_tasks_per_child=1) as pool:
+        futures = dict()
+        for run_name, name, argv in runs:
+            run_dir = os.path.join(args.output_dir, run_name)
+            futures[pool.submit(_sweep_run, run_dir, argv)] = (run_name, name)
+        for future in concurrent.futures.as_completed(futures):
+            run_name, name = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # a failed run must not abort the whole sweep
+                result = {"error": repr(e)}
+            result["run"] = run_name
+            result["interfaces"] = name
+            results.append(result)
+            print("finished {} ({}/{})".format(run_name, len(results), len(runs)))
+
+    results.sort(key=lambda result: result["run"])
+    fields = ["run", "routers", "area-x", "area-y", "tx-interval", "interfaces", "seed"]
+    for result in results:
+        fields += [k for k in result if k not in fields]
+    with open(os.path.join(args.output_dir, "results.csv"), "w", newline="") as fd:
+        writer = csv.DictWriter(fd, fieldnames=fields, restval="")
+        writer.writeheader()
+        writer.writerows(results)
+    print("results written to {}".format(os.path.join(args.output_dir, "results.csv")))
+
+
+def main():
+    args = parse_args()
+    if args.sweep:
+        run_sweep(args)
+        return
+    result = simulate(args)
+    print_statistics()
+    if args.summary_json:
+        result["flows"] = TRAFFIC.statistics()
+        with open(args.summary_json, "w") as fd:
+            json.dump(result, fd, indent=2)
+    if args.render == "png":
+        cmd = "ffmpeg -framerate {} -pattern_type glob -i '{}/*.png' -c:v libx264 -pix_fmt yuv420p {}"
+        cmd = cmd.format(args.framerate, PATH_IMAGES_MERGE, args.video)
+        print("now execute \"{}\" to generate a video".format(cmd))
 
 
 if __name__ == '__main__':
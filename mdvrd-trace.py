@@ -0,0 +1,179 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Offline queries on binary event traces recorded with
+# mdvrd-simulator.py --trace FILE, without re-running the simulation.
+
+import sys
+import mmap
+import zlib
+import array
+import struct
+import argparse
+import collections
+
+
+# must match TraceWriter of the simulator, interfaces are recorded as
+# their index in the interface table
+MAGIC = b"MDVRDTR1"
+COLUMNS = (("time", "d"), ("router", "i"), ("event", "B"), ("peer", "i"),
+           ("interface", "b"), ("seq-no", "i"), ("fib-version", "i"))
+
+EVENTS = {1: "route-tx", 2: "route-rx", 3: "expire", 4: "recalc",
+          5: "route-change-low_loss", 6: "route-change-high_bandwidth",
+          7: "data-fwd", 8: "data-deliver", 9: "data-drop"}
+EVENT_IDS = {name: event for event, name in EVENTS.items()}
+
+
+class Trace:
+    """Memory maps a trace file. Chunks are located once, columns are
+    decompressed on access and only the requested ones."""
+
+    def __init__(self, path):
+        self._fd = open(path, 'rb')
+        self._map = mmap.mmap(self._fd.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise Exception("{} is not a trace file".format(path))
+        self.chunks = list()
+        offset = len(MAGIC)
+        while offset < len(self._map):
+            records, = struct.unpack_from("<I", self._map, offset)
+            offset += 4
+            columns = list()
+            for _ in COLUMNS:
+                length, = struct.unpack_from("<I", self._map, offset)
+                offset += 4
+                columns.append((offset, length))
+                offset += length
+            self.chunks.append((records, columns))
+
+
+    def __len__(self):
+        return sum(records for records, _ in self.chunks)
+
+
+    def _column(self, columns, idx):
+        offset, length = columns[idx]
+        data = array.array(COLUMNS[idx][1])
+        data.frombytes(zlib.decompress(self._map[offset:offset + length]))
+        if sys.byteorder != "little":
+            data.byteswap()
+        return data
+
+
+    def columns(self, *names):
+        """yields one tuple of column arrays per chunk"""
+        idx = [[name for name, _ in COLUMNS].index(name) for name in names]
+        for _, columns in self.chunks:
+            yield tuple(self._column(columns, i) for i in idx)
+
+
+    def records(self, *names):
+        for chunk in self.columns(*names):
+            yield from zip(*chunk)
+
+
+    def close(self):
+        self._map.close()
+        self._fd.close()
+
+
+def cmd_summary(trace, args):
+    counts = collections.Counter()
+    time_min, time_max = None, None
+    for time, event in trace.records("time", "event"):
+        counts[event] += 1
+        if time_min is None or time < time_min:
+            time_min = time
+        if time_max is None or time > time_max:
+            time_max = time
+    print("records: {} in {} chunks, time {} - {}".format(len(trace), len(trace.chunks), time_min, time_max))
+    for event in sorted(counts):
+        print("{:>28}: {}".format(EVENTS.get(event, event), counts[event]))
+
+
+def cmd_route_changes(trace, args):
+    events = {EVENT_IDS["route-change-" + tos] for tos in args.tos}
+    print("{:>8} {:>15} {:>9} {:>9} {:>11}".format("time", "tos", "next-hop", "interface", "fib-version"))
+    for time, router, event, peer, interface, next_hop, fib_version in trace.records(
+            "time", "router", "event", "peer", "interface", "seq-no", "fib-version"):
+        if router != args.router or peer != args.dest or event not in events:
+            continue
+        tos = EVENTS[event][len("route-change-"):]
+        if next_hop < 0:
+            print("{:8} {:>15} {:>9} {:>9} {:11}".format(time, tos, "-", "-", fib_version))
+        else:
+            print("{:8} {:>15} {:9} {:9} {:11}".format(time, tos, next_hop, interface, fib_version))
+
+
+def cmd_iface_counts(trace, args):
+    event_id = EVENT_IDS[args.event]
+    counts = collections.defaultdict(collections.Counter)
+    interfaces = set()
+    for time, event, interface in trace.records("time", "event", "interface"):
+        if event != event_id:
+            continue
+        counts[int(time // args.bucket)][interface] += 1
+        interfaces.add(interface)
+    interfaces = sorted(interfaces)
+    print("{:>8} ".format("time") + " ".join("{:>8}".format("if-" + str(i)) for i in interfaces))
+    for bucket in sorted(counts):
+        line = "{:8} ".format(bucket * args.bucket)
+        print(line + " ".join("{:8}".format(counts[bucket][i]) for i in interfaces))
+
+
+def cmd_events(trace, args):
+    names = [name for name, _ in COLUMNS]
+    print(" ".join("{:>11}".format(name) for name in names))
+    for record in trace.records(*names):
+        r = dict(zip(names, record))
+        if args.router is not None and r["router"] != args.router:
+            continue
+        if args.peer is not None and r["peer"] != args.peer:
+            continue
+        if args.event is not None and r["event"] != EVENT_IDS[args.event]:
+            continue
+        r["event"] = EVENTS.get(r["event"], r["event"])
+        print(" ".join("{:>11}".format(r[name]) for name in names))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="query MDVRD simulator event traces")
+    parser.add_argument("trace", help="trace file")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    p = subparsers.add_parser("summary", help="number of records per event type")
+    p.set_defaults(func=cmd_summary)
+
+    p = subparsers.add_parser("route-changes", help="when did the route of a router to a destination change")
+    p.add_argument("--router", type=int, required=True)
+    p.add_argument("--dest", type=int, required=True)
+    p.add_argument("--tos", nargs="+", choices=("low_loss", "high_bandwidth"),
+                   default=("low_loss", "high_bandwidth"))
+    p.set_defaults(func=cmd_route_changes)
+
+    p = subparsers.add_parser("iface-counts", help="per interface packet counts over time")
+    p.add_argument("--event", choices=("route-tx", "route-rx", "expire", "data-fwd"), default="route-rx")
+    p.add_argument("--bucket", type=float, default=60, help="bucket size in seconds")
+    p.set_defaults(func=cmd_iface_counts)
+
+    p = subparsers.add_parser("events", help="print records, optionally filtered")
+    p.add_argument("--router", type=int)
+    p.add_argument("--peer", type=int)
+    p.add_argument("--event", choices=sorted(EVENT_IDS))
+    p.set_defaults(func=cmd_events)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    trace = Trace(args.trace)
+    try:
+        args.func(trace, args)
+    finally:
+        trace.close()
+
+
+if __name__ == '__main__':
+    main()
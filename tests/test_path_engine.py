@@ -0,0 +1,80 @@
+import os
+import random
+import importlib.util
+
+import pytest
+
+
+SIMULATOR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "mdvrd-simulator.py")
+
+
+@pytest.fixture(scope="module")
+def sim():
+    pytest.importorskip("cairo")
+    spec = importlib.util.spec_from_file_location("mdvrd_simulator", SIMULATOR)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def best_widest(edges, source, dest):
+    """brute force over all simple paths: the maximum bottleneck and the
+    fewest hops among the paths with that bottleneck"""
+    adj = dict()
+    for a, b, weight in edges:
+        adj.setdefault(a, dict())[b] = weight
+        adj.setdefault(b, dict())[a] = weight
+    best = None
+    stack = [(source, [source], float("inf"))]
+    while stack:
+        node, path, bottleneck = stack.pop()
+        if node == dest:
+            key = (-bottleneck, len(path) - 1)
+            if best is None or key < best:
+                best = key
+            continue
+        for other, weight in adj.get(node, {}).items():
+            if other not in path:
+                stack.append((other, path + [other], min(bottleneck, weight)))
+    return best
+
+
+def widest(sim, edges, source):
+    engine = sim.PathEngine()
+    for a, b, weight in edges:
+        engine.add_edge("high_bandwidth", a, b, weight)
+    trees = engine.widest_paths("high_bandwidth", source)
+    return {dest: sim.PathEngine.path_to_source(tree, dest)[::-1] for dest, tree in trees.items()}
+
+
+def path_key(edges, path):
+    weights = dict()
+    for a, b, weight in edges:
+        weights[(a, b)] = weights[(b, a)] = weight
+    return (-min(weights[hop] for hop in zip(path, path[1:])), len(path) - 1)
+
+
+def test_equal_bottleneck_fewest_hops(sim):
+    # 0-1-2-3 is wider up to 3, but 9 is limited to 5 by 3-9 anyway
+    edges = [(0, 1, 10), (1, 2, 10), (2, 3, 10), (0, 4, 5), (4, 3, 5), (3, 9, 5)]
+    paths = widest(sim, edges, 0)
+    assert paths[3] == [0, 1, 2, 3]
+    assert paths[9] == [0, 4, 3, 9]
+    for dest in (1, 2, 3, 4, 9):
+        assert path_key(edges, paths[dest]) == best_widest(edges, 0, dest)
+
+
+def test_random_graphs_match_brute_force(sim):
+    rnd = random.Random(1)
+    for _ in range(300):
+        no_router = rnd.randint(2, 8)
+        edges = [(a, b, rnd.choice((1000, 2000, 10000, 30000)))
+                 for a in range(no_router) for b in range(a + 1, no_router)
+                 if rnd.random() < 0.4]
+        paths = widest(sim, edges, 0)
+        for dest in range(1, no_router):
+            best = best_widest(edges, 0, dest)
+            if best is None:
+                assert dest not in paths
+            else:
+                assert path_key(edges, paths[dest]) == best